@@ -0,0 +1,28 @@
+from django.contrib.contenttypes.generic import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+from fields import GenericManyToManyField, JSONField, TemplateField
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50)
+
+class Article(models.Model):
+    title = models.CharField(max_length=100)
+    tags = GenericManyToManyField(Tag, through='TaggedItem', batch_size=300)
+
+class TaggedItem(models.Model):
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    tag = models.ForeignKey(Tag, related_name='tagged_items')
+
+    class Meta:
+        unique_together = (('content_type', 'object_id', 'tag'),)
+
+class Document(models.Model):
+    data = JSONField()
+    lazy_data = JSONField(lazy=True, null=True)
+
+class Page(models.Model):
+    template = TemplateField(max_length=255)
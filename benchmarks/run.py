@@ -0,0 +1,190 @@
+"""
+Benchmarks of the custom fields' hot paths, on an in-memory sqlite database.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json --tolerance 0.2
+
+Each benchmark records its best wall time over --repeat runs and the largest
+number of queries of its runs, so that the counts don't depend on --repeat. With --baseline, the run fails when a benchmark
+issues more queries than the baseline or is slower by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'custom-fields'))
+
+from django.conf import settings
+
+settings.configure(
+    DEBUG=True, # records connection.queries
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    INSTALLED_APPS=['django.contrib.contenttypes', 'benchmarks.benchapp'],
+    TEMPLATE_DIRS=[os.path.join(ROOT, 'benchmarks', 'templates')],
+    TEMPLATE_LOADERS=['django.template.loaders.filesystem.Loader'],
+)
+
+from django.core.management import call_command
+from django.db import connection, reset_queries
+
+results = {}
+
+def measure(name, func, setup=None, repeat=3):
+    """Record the best time of ``func`` and the most queries of one of its runs under ``name``"""
+    best = None
+    queries = 0
+    for i in range(repeat):
+        args = setup() if setup is not None else ()
+        reset_queries()
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+        queries = max(queries, len(connection.queries))
+    results[name] = {'seconds': best, 'queries': queries}
+
+def bench_generic_m2m(sizes, repeat):
+    from fields.GenericManyToManyField import get_content_type_id
+    from benchmarks.benchapp.models import Article, Tag
+
+    tags = list(Tag.objects.all())
+    # resolved once per process: not part of any benchmark
+    for model in (Article, Tag):
+        get_content_type_id(model, 'default')
+
+    def new_article():
+        return (Article.objects.create(title='article'),)
+
+    def tagged_article(size):
+        def setup():
+            article = Article.objects.create(title='article')
+            article.tags.add(*tags[:size])
+            return (article,)
+        return setup
+
+    article = Article.objects.create(title='article')
+    measure('gm2m.descriptor_access.x1000', lambda: [article.tags for i in xrange(1000)], repeat=repeat)
+
+    for size in sizes:
+        measure('gm2m.add.%s' % size, lambda a: a.tags.add(*tags[:size]), new_article, repeat)
+        measure('gm2m.set_one_change.%s' % size, lambda a: a.tags.set(*tags[1:size + 1]), tagged_article(size), repeat)
+        measure('gm2m.remove_half.%s' % size, lambda a: a.tags.remove(*tags[:size // 2]), tagged_article(size), repeat)
+        measure('gm2m.clear.%s' % size, lambda a: a.tags.clear(), tagged_article(size), repeat)
+        measure('gm2m.all.%s' % size, lambda a: list(a.tags.all()), tagged_article(size), repeat)
+        measure('gm2m.reverse_all.%s' % size, lambda a: list(tags[0].article_set.all()), tagged_article(size), repeat)
+        measure('gm2m.iterator.%s' % size, lambda a: list(a.tags.iterator()), tagged_article(size), repeat)
+
+    Article.objects.all().delete()
+    for i in range(100):
+        Article.objects.create(title='article %s' % i).tags.add(*tags[i:i + 10])
+    measure('gm2m.no_prefetch.100x10',
+            lambda: [list(a.tags.all()) for a in Article.objects.all()], repeat=repeat)
+    measure('gm2m.prefetch.100x10',
+            lambda: [list(a.tags.all()) for a in Article.objects.prefetch_related('tags')], repeat=repeat)
+    measure('gm2m.reverse_prefetch.100x10',
+            lambda: [list(t.article_set.all()) for t in Tag.objects.filter(pk__lte=100).prefetch_related('article_set')],
+            repeat=repeat)
+
+def bench_json(doc_sizes, repeat):
+    from fields.JSONField import compile_schema
+    from benchmarks.benchapp.models import Document
+
+    field = Document._meta.get_field('data')
+    for size in doc_sizes:
+        doc = {'items': [{'id': i, 'name': 'item %s' % i, 'tags': ['a', 'b', 'c']} for i in xrange(size)]}
+        text = field.encode(doc)
+        label = '%sitems' % size
+        measure('json.encode.%s' % label, lambda: field.encode(doc), repeat=repeat)
+        measure('json.decode.%s' % label, lambda: field.decode(text), repeat=repeat)
+
+        Document.objects.all().delete()
+        Document.objects.bulk_create([Document(data=text, lazy_data=text) for i in xrange(20)])
+        measure('json.load_20_rows.%s' % label, lambda: list(Document.objects.defer('lazy_data')), repeat=repeat)
+        measure('json.lazy_load_20_rows.%s' % label, lambda: list(Document.objects.defer('data')), repeat=repeat)
+
+    def check(doc):
+        if not isinstance(doc.get('id'), int):
+            raise ValueError('id')
+    validate = compile_schema(check)
+    docs = [{'id': i, 'name': 'doc'} for i in xrange(10000)]
+    measure('json.validate.10000docs', lambda: [validate(d) for d in docs], repeat=repeat)
+    try:
+        validate_schema = compile_schema({'type': 'object', 'required': ['id'],
+                                          'properties': {'id': {'type': 'integer'}, 'name': {'type': 'string'}}})
+    except Exception:
+        pass # jsonschema not installed
+    else:
+        measure('json.validate_jsonschema.10000docs', lambda: [validate_schema(d) for d in docs], repeat=repeat)
+
+def bench_templates(count, repeat):
+    from fields.TemplateField import TemplateFormField, invalidate_template_index
+
+    paths = ['bench/page_%s.html' % (i % 10) for i in xrange(count)]
+    form_field = TemplateFormField(max_length=255)
+    strict_field = TemplateFormField(max_length=255, strict=True)
+    def cold_index():
+        invalidate_template_index()
+        return ()
+    measure('template.clean.%s' % count, lambda: [form_field.clean(p) for p in paths], cold_index, repeat)
+    measure('template.clean_strict.%s' % count, lambda: [strict_field.clean(p) for p in paths], repeat=repeat)
+
+def compare(baseline, tolerance):
+    """Print the changes against ``baseline`` and return the regressions"""
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        current, base = results[name], baseline[name]
+        ratio = current['seconds'] / base['seconds'] if base['seconds'] else 1.0
+        line = "%-45s %8.4fs (%+6.1f%%) %5s queries (baseline %s)" % (
+            name, current['seconds'], (ratio - 1) * 100, current['queries'], base['queries'])
+        if current['queries'] > base['queries'] or ratio > 1 + tolerance:
+            regressions.append(name)
+            line += "  REGRESSION"
+        print line
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,1000', help='relation counts of the generic m2m benchmarks (e.g. 10,1000,100000)')
+    parser.add_argument('--doc-sizes', default='10,1000,10000', help='items per JSON document')
+    parser.add_argument('--templates', type=int, default=10000, help='template paths validated in bulk')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results with this JSON file')
+    parser.add_argument('--save-baseline', help='write the results as a new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown ratio against the baseline')
+    options = parser.parse_args()
+
+    sizes = [int(s) for s in options.sizes.split(',')]
+    call_command('syncdb', interactive=False, verbosity=0)
+
+    from benchmarks.benchapp.models import Tag
+    from fields.GenericManyToManyField import batches
+    for batch in batches([Tag(name='tag %s' % i) for i in xrange(max(sizes) + 1)], 400):
+        Tag.objects.bulk_create(batch) # sqlite: at most 500 rows per insert
+
+    bench_generic_m2m(sizes, options.repeat)
+    bench_json([int(s) for s in options.doc_sizes.split(',')], options.repeat)
+    bench_templates(options.templates, options.repeat)
+
+    for path in (options.output, options.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True, separators=(',', ': '))
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(json.load(f), options.tolerance)
+        if regressions:
+            sys.exit("%s benchmarks regressed" % len(regressions))
+    elif not options.output and not options.save_baseline:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True, separators=(',', ': '))
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,38 @@
 from django.db.models import CharField
 import re
+from django import forms
 from django.forms.util import ValidationError
 from django.utils.translation import ugettext_lazy as _
 
+# [\w_][\d\w_]+ as a whole, with a first char that is not a digit
+_match_context_name = re.compile(r'[^\W\d]\w+\Z').match
+
 def ContextNameValidator(value):
-    r = re.findall(r'[\w_][\d\w_]+', value)
-    if not(bool(re) and len(r) == 1):
-        raise FormValidationError(_('A-z 1-9 _ only. (with first char not 1-9)'))
+    if not _match_context_name(value):
+        raise ValidationError(_('A-z 1-9 _ only. (with first char not 1-9)'))
     return value
+
+def validate_many(values):
+    """Indices of the invalid context names of ``values``, checked in one pass"""
+    match = _match_context_name
+    return [i for i, value in enumerate(values) if not (isinstance(value, basestring) and match(value))]
+
+ContextNameValidator.validate_many = validate_many
+
+class ContextNameFormField(forms.CharField):
+    default_validators = [ContextNameValidator]
+
+class ContextNameField(CharField):
+    """ Field to store a context variable name"""
+    default_validators = [ContextNameValidator]
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', 255)
+        super(ContextNameField, self).__init__(*args, **kwargs)
+
+    def formfield(self, **kwargs):
+
+        if "form_class" not in kwargs:
+            kwargs["form_class"] = ContextNameFormField
+
+        return super(ContextNameField, self).formfield(**kwargs)
@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
-from django.contrib.contenttypes.generic import GenericForeignKey
+from django.conf import settings
+from django.contrib.contenttypes.generic import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
-from django.db import router, DEFAULT_DB_ALIAS
+from django.core.cache import cache
+from django.db import connections, router, transaction, DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, post_syncdb
 from django.db.models.fields import Field
 from django.db.models.fields.related import ManyToManyRel, RelatedField, add_lazy_relation, ManyRelatedObjectsDescriptor, ReverseManyRelatedObjectsDescriptor
+from django.dispatch import Signal
 from django.utils.functional import curry
+from functools import wraps
+from operator import attrgetter
+import logging
+import random
+import threading
+import time
 
 from django import forms
 from django.utils.translation import ugettext as _, string_concat
@@ -12,6 +22,277 @@ from django.utils.translation import ugettext as _, string_concat
 def is_gfk_field(field):
     return isinstance(field, GenericForeignKey)
 
+# (model, database alias) -> content type id
+_content_type_ids = {}
+_content_type_ids_lock = threading.Lock()
+
+def get_content_type_id(model, using=None):
+    "Return the content type id of ``model`` on ``using``, resolved once per process"
+    key = (model, using)
+    try:
+        return _content_type_ids[key]
+    except KeyError:
+        ct_id = ContentType.objects.db_manager(using).get_for_model(model).pk
+        with _content_type_ids_lock:
+            _content_type_ids[key] = ct_id
+        return ct_id
+
+def clear_content_type_cache(**kwargs):
+    "Forget the resolved content type ids (connected to flush and ContentType deletion)"
+    with _content_type_ids_lock:
+        _content_type_ids.clear()
+
+post_syncdb.connect(clear_content_type_cache, dispatch_uid='gm2m_clear_content_type_cache')
+post_delete.connect(clear_content_type_cache, sender=ContentType, dispatch_uid='gm2m_clear_content_type_cache')
+
+# How the managers select the related objects:
+#  - 'distinct': join the through table and apply DISTINCT (or a subquery)
+#  - 'join': plain join on the through table, without DISTINCT
+#  - 'exists': correlated EXISTS (SELECT 1 FROM through ...) predicate
+# 'join' and 'exists' rely on (content type, object id, target) being unique
+# in the through table, otherwise 'join' returns duplicated rows.
+QUERY_STRATEGIES = ('distinct', 'join', 'exists')
+
+# Cached instead of the related ids when there are more than cache_max_ids
+TOO_MANY_IDS = 'too many'
+
+# Related objects loaded per query by the managers' iter_chunks() / iterator()
+DEFAULT_CHUNK_SIZE = 1000
+
+def batches(items, batch_size=None):
+    "Split ``items`` in lists of at most ``batch_size`` elements (a single list if not set)"
+    items = list(items)
+    batch_size = batch_size or len(items) or 1
+    for i in xrange(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+def iter_through_chunks(rows, id_field, queryset, size=DEFAULT_CHUNK_SIZE):
+    """
+    Walk the through ``rows`` by primary key (keyset pagination, no OFFSET) and
+    yield lists of the objects of ``queryset`` their ``id_field`` points to,
+    at most ``size`` at a time, in through table order.
+    """
+    pk = queryset.model._meta.pk
+    rows = rows.order_by('pk')
+    last = None
+    while True:
+        chunk_rows = rows if last is None else rows.filter(pk__gt=last)
+        chunk = list(chunk_rows.values_list('pk', id_field)[:size])
+        if not chunk:
+            return
+        last = chunk[-1][0]
+        ids = [pk.to_python(obj_id) for row_pk, obj_id in chunk]
+        objs = queryset.in_bulk(ids)
+        yield [objs[obj_id] for obj_id in ids if obj_id in objs]
+        if len(chunk) < size:
+            return
+
+def fetch_generic_objects(rows, gfk, source_field_name, using):
+    """
+    Resolve the objects the generic foreign key ``gfk`` of the through ``rows``
+    points to, whatever their content type: one query on the through table,
+    then one in_bulk() per content type.
+    Return {source id: [objects in through table order]}.
+    """
+    links = list(rows.order_by('pk').values_list(source_field_name, gfk.ct_field, gfk.fk_field))
+
+    ids_by_type = {}
+    for source_id, ct_id, obj_id in links:
+        ids_by_type.setdefault(ct_id, set()).add(obj_id)
+
+    objects = {}
+    for ct_id, ids in ids_by_type.iteritems():
+        model = ContentType.objects.db_manager(using).get_for_id(ct_id).model_class()
+        if model is None:
+            continue
+        pk = model._meta.pk
+        bulk = model._base_manager.using(using).in_bulk([pk.to_python(obj_id) for obj_id in ids])
+        for obj_id in ids:
+            obj = bulk.get(pk.to_python(obj_id))
+            if obj is not None:
+                objects[ct_id, obj_id] = obj
+
+    related = {}
+    for source_id, ct_id, obj_id in links:
+        obj = objects.get((ct_id, obj_id))
+        if obj is not None:
+            related.setdefault(source_id, []).append(obj)
+    return related
+
+# Instrumentation of the related managers and descriptors.
+# Every sink is called with the keyword arguments of ``gm2m_operation``:
+# operation ('access', 'get_query_set', 'add', 'remove', 'set', 'clear'),
+# field, through, reverse, ids (number of objects passed, or returned for
+# 'get_query_set'), using, queries (issued on ``using``) and elapsed (seconds).
+# 'get_query_set' is reported when the queryset is iterated, with the queries
+# and time of its evaluation (count(), exists(), ... are not reported).
+# Nothing is measured while no sink is registered.
+_sinks = []
+_sample_rate = 1.0
+
+gm2m_operation = Signal(providing_args=['operation', 'field', 'through', 'reverse', 'ids', 'using', 'queries', 'elapsed'])
+
+def register_sink(sink):
+    "Report the instrumented operations to ``sink``"
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+def unregister_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+def set_sample_rate(rate):
+    "Only report a fraction ``rate`` (0 to 1) of the operations"
+    global _sample_rate
+    _sample_rate = float(rate)
+
+def signal_sink(**record):
+    "Sink sending the ``gm2m_operation`` signal, with the through model as sender"
+    gm2m_operation.send(sender=record['through'], **record)
+
+class LoggingSink(object):
+    "Sink writing one log line per operation"
+
+    def __init__(self, logger='fields.gm2m', level=logging.DEBUG):
+        self.logger = logging.getLogger(logger) if isinstance(logger, basestring) else logger
+        self.level = level
+
+    def __call__(self, **record):
+        self.logger.log(self.level, "%s %s.%s%s through %s: %s ids, %s queries on %s, %.6fs",
+            record['operation'], record['field'].model._meta.object_name, record['field'].name,
+            ' (reverse)' if record['reverse'] else '', record['through']._meta.object_name,
+            record['ids'], record['queries'], record['using'], record['elapsed'])
+
+def _sampled():
+    return _sample_rate >= 1.0 or random.random() < _sample_rate
+
+class _Measure(object):
+    "Queries run on ``using`` (counted with the debug cursor) and time spent between start() and stop()"
+
+    def __init__(self, using):
+        self.connection = connections[using]
+        self.queries = 0
+        self.elapsed = 0.0
+
+    def start(self):
+        connection = self.connection
+        self.use_debug_cursor = connection.use_debug_cursor
+        self.recording = self.use_debug_cursor or (self.use_debug_cursor is None and settings.DEBUG)
+        connection.use_debug_cursor = True
+        self.first_query = len(connection.queries)
+        self.started = time.time()
+
+    def stop(self):
+        connection = self.connection
+        self.elapsed += time.time() - self.started
+        self.queries += len(connection.queries) - self.first_query
+        if not self.recording:
+            del connection.queries[self.first_query:]
+        connection.use_debug_cursor = self.use_debug_cursor
+
+def _send(operation, field, through, reverse, ids, using, measure):
+    for sink in list(_sinks):
+        sink(operation=operation, field=field, through=through, reverse=reverse,
+             ids=ids, using=using, queries=measure.queries, elapsed=measure.elapsed)
+
+def _report(operation, field, through, reverse, ids, using, func, *args, **kwargs):
+    "Run ``func`` counting its queries on ``using`` and its time, then call the sinks"
+    measure = _Measure(using)
+    measure.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        measure.stop()
+        _send(operation, field, through, reverse, ids, using, measure)
+
+def _report_iterator(instrumentation, using, iterator):
+    "Iterate over ``iterator`` measuring the fetches only (not the caller's work), then call the sinks"
+    measure = _Measure(using)
+    count = 0
+    try:
+        while True:
+            measure.start()
+            try:
+                obj = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                measure.stop()
+            count += 1
+            yield obj
+    finally:
+        _send(*(instrumentation + (count, using, measure)))
+
+# queryset class -> its subclass returned by the related managers
+_related_querysets = {}
+
+def related_queryset(qs):
+    """
+    Return a clone of ``qs`` whose evaluation reads the cached related ids
+    (set as ``_cached_ids``) and is reported to the sinks (``_instrumentation``)
+    """
+    cls = qs.__class__
+    try:
+        klass = _related_querysets[cls]
+    except KeyError:
+        class RelatedQuerySet(cls):
+            _instrumentation = None
+            # (field, reverse, instance, through rows, id field, db, queryset of the targets):
+            # only on the queryset built by the manager, not on the ones derived from it
+            _cached_ids = None
+
+            def _clone(self, klass=None, setup=False, **kwargs):
+                kwargs.setdefault('_instrumentation', self._instrumentation)
+                return super(RelatedQuerySet, self)._clone(klass, setup, **kwargs)
+
+            def iterator(self):
+                iterator = self._fetch()
+                if self._instrumentation is None or not _sinks:
+                    return iterator
+                return _report_iterator(self._instrumentation, self.db, iterator)
+
+            def _fetch(self):
+                ids = None
+                if self._cached_ids is not None:
+                    field, reverse, instance, rows, id_field, db, targets = self._cached_ids
+                    ids = field.get_cached_ids(reverse, instance, rows, id_field, db)
+                if ids is None:
+                    iterator = super(RelatedQuerySet, self).iterator()
+                else:
+                    # SELECT target.* FROM target WHERE target.pk IN (cached ids)
+                    iterator = targets.filter(pk__in=ids).iterator()
+                for obj in iterator:
+                    yield obj
+        klass = _related_querysets.setdefault(cls, RelatedQuerySet)
+        _related_querysets[klass] = klass
+    if isinstance(qs, klass):
+        return qs
+    return qs._clone(klass=klass)
+
+def instrumented(operation, write=False):
+    "Decorate a related manager method so that its calls are reported to the sinks"
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not (_sinks and _sampled()):
+                return method(self, *args, **kwargs)
+            if operation == 'get_query_set':
+                qs = method(self, *args, **kwargs)
+                if qs._result_cache is not None: # prefetched
+                    return qs
+                qs = related_queryset(qs)
+                qs._instrumentation = (operation, self.field, self.through, self.reverse)
+                return qs
+            if write:
+                using = router.db_for_write(self.through, instance=self.instance)
+            else:
+                using = router.db_for_read(self.instance.__class__, instance=self.instance)
+            ids = len(args) if operation in ('add', 'remove', 'set') else None
+            return _report(operation, self.field, self.through, self.reverse, ids, using,
+                           method, self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 class GenericManyToManyField(RelatedField, Field):
     description = _("Generic Many-to-many relationship")
 
@@ -23,6 +304,13 @@ class GenericManyToManyField(RelatedField, Field):
 
         kwargs['verbose_name'] = kwargs.get('verbose_name', None)
         self.through = through
+        self.batch_size = kwargs.pop('batch_size', None) # rows per bulk insert in add()
+        self.query_strategy = kwargs.pop('query_strategy', 'distinct')
+        assert self.query_strategy in QUERY_STRATEGIES, "query_strategy must be one of %s" % (QUERY_STRATEGIES,)
+        # cache the related ids of each instance for cache_timeout seconds (not cached if None),
+        # unless there are more than cache_max_ids of them
+        self.cache_timeout = kwargs.pop('cache_timeout', None)
+        self.cache_max_ids = kwargs.pop('cache_max_ids', 1000)
         kwargs['rel'] = ManyToManyRel(to,
                                       related_name=kwargs.pop('related_name', None),
                                       limit_choices_to=kwargs.pop('limit_choices_to', None),
@@ -120,6 +408,13 @@ class GenericManyToManyField(RelatedField, Field):
                 add_lazy_relation(
                     cls, self, self.through, resolve_related_class
                 )
+            if self.cache_timeout is not None:
+                def connect_through_signals(field, model, cls):
+                    post_delete.connect(self._through_row_deleted, sender=model, weak=False,
+                                        dispatch_uid='gm2m_cache_%s_%s' % (id(self), id(model)))
+                add_lazy_relation(
+                    cls, self, self.through, connect_through_signals
+                )
 
     def contribute_to_related_class(self, cls, related):
 
@@ -135,6 +430,25 @@ class GenericManyToManyField(RelatedField, Field):
         self.m2m_column_name = curry(self._get_column_for_field, related, self.m2m_field_name)
         self.m2m_reverse_name = curry(self._get_column_for_field, related, self.m2m_reverse_field_name)
 
+        if not cls._meta.abstract:
+            def add_deletion_relation(field, model, source):
+                self.through = model # may run before contribute_to_class resolves it
+                self.contribute_deletion_relation(cls)
+            add_lazy_relation(related.model, self, self.through, add_deletion_relation)
+
+    def contribute_deletion_relation(self, cls):
+        """
+        When the generic foreign key of the through model points to ``cls`` (the
+        related model), add a hidden generic relation to ``cls`` so that the
+        deletion collector also deletes the through rows of its deleted objects.
+        """
+        if self.has_generic_source():
+            return # this field's bulk_related_objects() handles them
+        gfk, fk = self.get_through_fields()
+        relation = GenericRelation(self.through, related_name='+',
+                                   object_id_field=gfk.fk_field, content_type_field=gfk.ct_field)
+        relation.contribute_to_class(cls, '%s_%s_gm2m' % (self.model._meta.module_name, self.name))
+
     def m2m_db_table(self):
         return self.through._meta.db_table
 
@@ -173,6 +487,28 @@ class GenericManyToManyField(RelatedField, Field):
 
         return super(GenericManyToManyField, self).formfield(**defaults)
 
+    def get_through_fields(self):
+        "Return the generic foreign key and the foreign key field of the through model"
+        source = getattr(self.through, self.m2m_field_name())
+        if is_gfk_field(source):
+            return source, self.through._meta.get_field(self.m2m_reverse_field_name())
+        return getattr(self.through, self.m2m_reverse_field_name()), self.through._meta.get_field(self.m2m_field_name())
+
+    def has_generic_source(self):
+        "Whether the generic foreign key of the through model points to this field's model"
+        return is_gfk_field(getattr(self.through, self.m2m_field_name()))
+
+    def through_index_columns(self):
+        """
+        Columns of the through table the managers look up together:
+        (content type, object id, foreign key).
+        """
+        opts = self.through._meta
+        gfk, fk = self.get_through_fields()
+        return (opts.get_field(gfk.ct_field).column,
+                opts.get_field(gfk.fk_field).column,
+                fk.column)
+
     def db_type(self, connection=None):
         # A ManyToManyField is not represented by a single column,
         # so return None.
@@ -189,43 +525,219 @@ class GenericManyToManyField(RelatedField, Field):
         relation = getattr(self.through, self.m2m_field_name())
         if not is_gfk_field(relation):
             return []
-        content_type = ContentType.objects.get_for_model(self.model)
+        content_type_id = get_content_type_id(self.model)
         prefix = "__".join(pieces[:pos + 2])
         return [("%s__%s" % (prefix, relation.ct_field),
-            content_type)]
+            content_type_id)]
 
     def bulk_related_objects(self, objs, using=DEFAULT_DB_ALIAS):
         """
-        Return all objects related to ``objs`` via this ``GenericRelation``.
-
+        Return the through rows linking ``objs`` (instances of this field's
+        model) through the generic foreign key, for the deletion collector.
+        When the through model has a foreign key to this field's model, the
+        collector already cascades on it and there is nothing to return (the
+        related model's objects are handled by contribute_deletion_relation).
         """
-        field_name = self.related_query_name()
-        return self.rel.to._base_manager.db_manager(using).filter(**{
-                "%s__pk" % field_name:
-                    ContentType.objects.db_manager(using).get_for_model(self.model).pk,
-                "%s__in" % field_name:
-                    [obj.pk for obj in objs]
+        if not self.has_generic_source():
+            return self.through._base_manager.db_manager(using).none()
+        return self.through_rows(get_content_type_id(self.model, using), [obj.pk for obj in objs], using)
+
+    def through_rows(self, ct_id, ids, using=DEFAULT_DB_ALIAS):
+        "Return the through rows whose generic foreign key points to the objects ``ids`` of content type ``ct_id``"
+        gfk, fk = self.get_through_fields()
+        return self.through._base_manager.db_manager(using).filter(**{
+                self.through._meta.get_field(gfk.ct_field).attname: ct_id,
+                "%s__in" % gfk.fk_field: ids,
                 })
 
+    def related_ids_cache_key(self, reverse, ct_id, pk):
+        "Cache key of the related ids of the object (``ct_id``, ``pk``), on the reverse side or not"
+        opts = self.model._meta
+        return 'gm2m:%s.%s.%s:%d:%s:%s' % (opts.app_label, opts.object_name, self.name, reverse, ct_id, pk)
+
+    def get_cached_ids(self, reverse, instance, rows, id_field, using):
+        """
+        Return the related ids of ``instance`` from the cache, or read them from
+        the through ``rows`` and cache them. None when caching is disabled or
+        they are more than cache_max_ids.
+        """
+        if self.cache_timeout is None:
+            return None
+        key = self.related_ids_cache_key(reverse, get_content_type_id(instance.__class__, using), instance.pk)
+        ids = cache.get(key)
+        if ids is None:
+            rows = rows.values_list(id_field, flat=True)
+            if self.cache_max_ids is not None:
+                rows = rows[:self.cache_max_ids + 1]
+            ids = list(rows)
+            if self.cache_max_ids is not None and len(ids) > self.cache_max_ids:
+                ids = TOO_MANY_IDS
+            cache.set(key, ids, self.cache_timeout)
+        if ids == TOO_MANY_IDS:
+            return None
+        return ids
+
+    def invalidate_cached_ids(self, reverse, instance, related_model, ids, using):
+        "Drop the cached related ids of ``instance`` and of its related objects ``ids``"
+        if self.cache_timeout is None:
+            return
+        keys = [self.related_ids_cache_key(reverse, get_content_type_id(instance.__class__, using), instance.pk)]
+        related_ct_id = get_content_type_id(related_model, using)
+        keys.extend(self.related_ids_cache_key(not reverse, related_ct_id, pk) for pk in ids)
+        cache.delete_many(keys)
+
+    def invalidate_cached_links(self, ct_id, links, using):
+        "Drop the cached related ids of both ends of the (generic object id, foreign key id) ``links``"
+        if self.cache_timeout is None:
+            return
+        gfk, fk = self.get_through_fields()
+        generic_reverse = not self.has_generic_source()
+        fk_ct_id = get_content_type_id(fk.rel.to, using)
+        keys = set()
+        for obj_id, fk_id in links:
+            keys.add(self.related_ids_cache_key(generic_reverse, ct_id, obj_id))
+            keys.add(self.related_ids_cache_key(not generic_reverse, fk_ct_id, fk_id))
+        cache.delete_many(list(keys))
+
+    def _through_row_deleted(self, sender, instance, using, **kwargs):
+        "Drop the cached related ids of both ends of a deleted through row"
+        gfk, fk = self.get_through_fields()
+        ct_id = getattr(instance, self.through._meta.get_field(gfk.ct_field).attname)
+        self.invalidate_cached_links(ct_id, [(getattr(instance, gfk.fk_field), getattr(instance, fk.attname))], using)
+
+    def _group_links(self, pairs):
+        """
+        Group the (source, target) ``pairs`` by database and content type of
+        their generic end: {(db, ct_id): set of (generic object id, foreign key id)}.
+        """
+        from django.db.models import Model
+        gfk, fk = self.get_through_fields()
+        obj_id_field = self.through._meta.get_field(gfk.fk_field)
+        fk_model = fk.rel.to
+        generic_source = self.has_generic_source()
+        groups = {}
+        for source, target in pairs:
+            generic_obj, fk_obj = (source, target) if generic_source else (target, source)
+            if not isinstance(fk_obj, fk_model):
+                raise TypeError("'%s' instance expected" % fk_model._meta.object_name)
+            if not isinstance(generic_obj, Model):
+                raise TypeError("model instance expected, got %r" % (generic_obj,))
+            if not router.allow_relation(target, source):
+                raise ValueError('Cannot add "%r": instance is on database "%s", value is on database "%s"' %
+                                 (target, source._state.db, target._state.db))
+            db = router.db_for_write(self.through, instance=source)
+            ct_id = get_content_type_id(generic_obj.__class__, db)
+            link = (obj_id_field.to_python(generic_obj.pk), fk_obj.pk)
+            groups.setdefault((db, ct_id), set()).add(link)
+        return groups
+
+    def _existing_links(self, db, ct_id, links):
+        "Return {(generic object id, foreign key id): through row pk} for the ``links`` already stored"
+        gfk, fk = self.get_through_fields()
+        opts = self.through._meta
+        obj_id_field = opts.get_field(gfk.fk_field)
+        rows = self.through._default_manager.using(db).filter(**{
+            opts.get_field(gfk.ct_field).attname: ct_id,
+            '%s__in' % gfk.fk_field: set(obj_id for obj_id, fk_id in links),
+            '%s__in' % fk.name: set(fk_id for obj_id, fk_id in links),
+        })
+        existing = {}
+        for pk, obj_id, fk_id in rows.values_list('pk', gfk.fk_field, fk.name):
+            link = (obj_id_field.to_python(obj_id), fk_id)
+            if link in links:
+                existing[link] = pk
+        return existing
+
+    def bulk_link(self, pairs, batch_size=None):
+        """
+        Link every (source, target) pair of ``pairs``, whatever the instance:
+        per database and content type, one query skips the existing links,
+        then the through rows are inserted by ``batch_size`` (or the field's
+        batch_size). Unlike the managers' add(), m2m_changed is not sent.
+        Return the number of links created.
+        """
+        gfk, fk = self.get_through_fields()
+        ct_attname = self.through._meta.get_field(gfk.ct_field).attname
+        created = 0
+        for (db, ct_id), links in self._group_links(pairs).iteritems():
+            with transaction.commit_on_success(using=db):
+                new_links = links.difference(self._existing_links(db, ct_id, links))
+                for batch in batches(new_links, batch_size or self.batch_size):
+                    self.through._default_manager.using(db).bulk_create([
+                        self.through(**{ct_attname: ct_id, gfk.fk_field: obj_id, fk.attname: fk_id})
+                        for obj_id, fk_id in batch
+                    ])
+            self.invalidate_cached_links(ct_id, new_links, db)
+            created += len(new_links)
+        return created
+
+    def bulk_unlink(self, pairs, batch_size=None):
+        """
+        Remove the links of the (source, target) ``pairs``: per database and
+        content type, one query finds the through rows, which are then deleted
+        by ``batch_size`` (or the field's batch_size). m2m_changed is not sent.
+        Return the number of links removed.
+        """
+        removed = 0
+        for (db, ct_id), links in self._group_links(pairs).iteritems():
+            with transaction.commit_on_success(using=db):
+                existing = self._existing_links(db, ct_id, links)
+                for batch in batches(existing.values(), batch_size or self.batch_size):
+                    self.through._default_manager.using(db).filter(pk__in=batch).delete()
+            self.invalidate_cached_links(ct_id, existing, db)
+            removed += len(existing)
+        return removed
+
+def get_generic_m2m_fields():
+    "Yield every (model, GenericManyToManyField) of the installed models"
+    from django.db.models import get_models
+    for model in get_models():
+        for f in model._meta.local_many_to_many:
+            if isinstance(f, GenericManyToManyField):
+                yield model, f
+
 class ReverseGenericManyRelatedObjectsDescriptor(ReverseManyRelatedObjectsDescriptor):
 
+    def __init__(self, m2m_field):
+        super(ReverseGenericManyRelatedObjectsDescriptor, self).__init__(m2m_field)
+        self._relation = None
+
+    def _get_relation(self):
+        "Resolve (through, source, target, generic source) once the through model is loaded"
+        if self._relation is None:
+            through = self.field.through
+            source_field_name = self.field.m2m_field_name()
+            target_field_name = self.field.m2m_reverse_field_name()
+            generic = is_gfk_field(getattr(through, source_field_name))
+            self._relation = (through, source_field_name, target_field_name, generic)
+        return self._relation
+
     def __get__(self, instance, instance_type=None):
-        if instance is not None and instance.pk is None:
+        if instance is None:
+            return self
+        if _sinks and _sampled():
+            return _report('access', self.field, self._get_relation()[0], False, None,
+                           router.db_for_read(instance.__class__, instance=instance),
+                           self.related_manager, instance)
+        return self.related_manager(instance)
+
+    def related_manager(self, instance):
+        if instance.pk is None:
             raise AttributeError("Manager must be accessed via instance")
 
         rel_model=self.field.rel.to
         superclass = rel_model._default_manager.__class__
-        through = self.field.through
+        through, source_field_name, target_field_name, generic = self._get_relation()
 
-        if is_gfk_field(getattr(through, self.field.m2m_field_name())):
-            RelatedManager = create_genegic_many_related_manager(superclass, through)
-        else:
-            RelatedManager = create_many_genegic_related_manager(superclass, through)
+        RelatedManager = get_related_manager(superclass, through, generic)
 
         manager = RelatedManager(model=rel_model, 
                                  instance=instance,
-                                 source_field_name=self.field.m2m_field_name(),
-                                 target_field_name=self.field.m2m_reverse_field_name(),
+                                 source_field_name=source_field_name,
+                                 target_field_name=target_field_name,
+                                 prefetch_cache_name=self.field.name,
+                                 field=self.field,
+                                 reverse=False,
                                 )
         return manager
 
@@ -241,24 +753,47 @@ class ReverseGenericManyRelatedObjectsDescriptor(ReverseManyRelatedObjectsDescri
 
 class GenericManyRelatedObjectsDescriptor(ManyRelatedObjectsDescriptor):
 
+    def __init__(self, related):
+        super(GenericManyRelatedObjectsDescriptor, self).__init__(related)
+        self._relation = None
+
+    def _get_relation(self):
+        "Resolve (through, source, target, generic source) once the through model is loaded"
+        if self._relation is None:
+            through = self.related.field.through
+            source_field_name = self.related.field.m2m_reverse_field_name()
+            target_field_name = self.related.field.m2m_field_name()
+            generic = is_gfk_field(getattr(through, source_field_name))
+            self._relation = (through, source_field_name, target_field_name, generic)
+        return self._relation
+
     def __get__(self, instance, instance_type=None):
-        if instance is not None and instance.pk is None:
+        if instance is None:
+            return self
+        if _sinks and _sampled():
+            return _report('access', self.related.field, self._get_relation()[0], True, None,
+                           router.db_for_read(instance.__class__, instance=instance),
+                           self.related_manager, instance)
+        return self.related_manager(instance)
+
+    def related_manager(self, instance):
+        if instance.pk is None:
             raise AttributeError("Manager must be accessed via instance")
 
         # model's default manager.
         rel_model = self.related.model
         superclass = rel_model._default_manager.__class__
-        through = self.related.field.through
+        through, source_field_name, target_field_name, generic = self._get_relation()
 
-        if is_gfk_field(getattr(through, self.related.field.m2m_reverse_field_name())):
-            RelatedManager = create_genegic_many_related_manager(superclass, through)
-        else:
-            RelatedManager = create_many_genegic_related_manager(superclass, through)
+        RelatedManager = get_related_manager(superclass, through, generic)
         
         manager = RelatedManager(model=rel_model, 
                                  instance=instance,
-                                 source_field_name=self.related.field.m2m_reverse_field_name(),
-                                 target_field_name=self.related.field.m2m_field_name(),
+                                 source_field_name=source_field_name,
+                                 target_field_name=target_field_name,
+                                 prefetch_cache_name=self.related.get_accessor_name(),
+                                 field=self.related.field,
+                                 reverse=True,
                                 )
 
         return manager
@@ -271,82 +806,233 @@ class GenericManyRelatedObjectsDescriptor(ManyRelatedObjectsDescriptor):
         manager.set(*value)
 
 
+# (superclass, through, generic source) -> related manager class
+_related_managers = {}
+
+def get_related_manager(superclass, through, generic):
+    "Return the related manager class for ``through``, building it only once"
+    key = (superclass, through, generic)
+    try:
+        return _related_managers[key]
+    except KeyError:
+        if generic:
+            manager = create_genegic_many_related_manager(superclass, through)
+        else:
+            manager = create_many_genegic_related_manager(superclass, through)
+        return _related_managers.setdefault(key, manager)
+
+
 def create_genegic_many_related_manager(superclass, through=False):
 
     class GenericManyToManyManager(superclass):
-        def __init__(self, model, instance, source_field_name, target_field_name):
+        def __init__(self, model, instance, source_field_name, target_field_name, prefetch_cache_name=None, field=None, reverse=False):
             self.through = through # generic through model
             self.model = model # source model  
             self.instance = instance  # source instance 
             self.source_field_name = source_field_name # generic accessor field (link to source)
             self.target_field_name = target_field_name # foreign key accessor field (link to target)
-
-            self.content_type = ContentType.objects.db_manager(instance._state.db).get_for_model(instance)
+            self.prefetch_cache_name = prefetch_cache_name
+            self._db = None # Manager.__init__ is not called
+            self.field = field
+            self.reverse = reverse
+            self.batch_size = field.batch_size if field is not None else None
+            self.query_strategy = field.query_strategy if field is not None else 'distinct'
+
+            self.content_type_id = get_content_type_id(instance.__class__, instance._state.db)
             self.source = getattr(self.through, self.source_field_name)
             self.target = getattr(self.through, self.target_field_name)
+            self.ct_attname = self.through._meta.get_field(self.source.ct_field).attname
 
             if not is_gfk_field(self.source):
                 raise TypeError("'%s' (%s) generic foreign key expected" % (self.source_field_name, type(self.source)))
             
 
+        @instrumented('get_query_set')
         def get_query_set(self):
+            try:
+                return self.instance._prefetched_objects_cache[self.prefetch_cache_name]
+            except (AttributeError, KeyError):
+                pass
+
             kwargs = {
-                "%s__%s" % (self.target.field.rel.related_name, self.source.ct_field): self.content_type,
+                "%s__%s" % (self.target.field.rel.related_name, self.source.ct_field): self.content_type_id,
                 "%s__%s" % (self.target.field.rel.related_name, self.source.fk_field): self.instance.pk
             }
 
             #return self.target.field.rel.to.objects.filter(**kwargs).distinct()
             db = self._db = router.db_for_read(self.instance.__class__, instance=self.instance)
-            return superclass.get_query_set(self).using(db).filter(**kwargs).distinct()
+            qs = superclass.get_query_set(self).using(db)
+            return self._cache_ids(self._filter_related(qs, kwargs, db), qs, self.target_field_name, db)
+
+        def _filter_related(self, qs, kwargs, db):
+            "Restrict ``qs`` to the objects related to the instance with the field's query strategy"
+            if self.query_strategy == 'distinct':
+                # SELECT DISTINCT target.* FROM target INNER JOIN through ON ... WHERE through.ct = %s AND through.fk = %s
+                return qs.filter(**kwargs).distinct()
+            if self.query_strategy == 'join':
+                # SELECT target.* FROM target INNER JOIN through ON ... WHERE through.ct = %s AND through.fk = %s
+                return qs.filter(**kwargs)
+            # SELECT target.* FROM target WHERE EXISTS (SELECT 1 FROM through WHERE through.target = target.pk AND ...)
+            qn = connections[db].ops.quote_name
+            where, params = self._through_conditions(qn)
+            return qs.extra(where=['EXISTS (SELECT 1 FROM %s WHERE %s)' % (qn(self.through._meta.db_table), ' AND '.join(where))],
+                            params=params)
+
+        def _cache_ids(self, qs, targets, id_field, db):
+            "Make ``qs`` read the cached related ids when it is evaluated, if the field caches them"
+            if self.field is None or self.field.cache_timeout is None:
+                return qs
+            qs = related_queryset(qs)
+            rows = self.through._default_manager.using(db).filter(**self._core_filters())
+            qs._cached_ids = (self.field, self.reverse, self.instance, rows, id_field, db, targets)
+            return qs
+
+        def _through_conditions(self, qn):
+            "SQL conditions selecting the through rows of the instance, correlated on the target table"
+            opts = self.through._meta
+            table = qn(opts.db_table)
+            target = opts.get_field(self.target_field_name)
+            fk = opts.get_field(self.source.fk_field)
+            where = [
+                '%s.%s = %s.%s' % (table, qn(target.column), qn(self.model._meta.db_table), qn(self.model._meta.pk.column)),
+                '%s.%s = %%s' % (table, qn(opts.get_field(self.source.ct_field).column)),
+                '%s.%s = %%s' % (table, qn(fk.column)),
+            ]
+            return where, [self.content_type_id, fk.get_prep_value(self.instance.pk)]
+
+        def get_prefetch_query_set(self, instances):
+            """
+            Fetch the targets of all ``instances`` with a single query joined on
+            the through table, annotated with the generic object id they belong to.
+            """
+            instance = instances[0]
+            db = router.db_for_read(instance.__class__, instance=instance)
+            fk = self.through._meta.get_field(self.source.fk_field)
+            kwargs = {
+                "%s__%s" % (self.target.field.rel.related_name, self.source.ct_field): self.content_type_id,
+                "%s__%s__in" % (self.target.field.rel.related_name, self.source.fk_field): set(fk.to_python(obj._get_pk_val()) for obj in instances),
+            }
+            qn = connections[db].ops.quote_name
+            qs = superclass.get_query_set(self).using(db).filter(**kwargs)
+            qs = qs.extra(select={'_prefetch_related_val': '%s.%s' % (qn(self.through._meta.db_table), qn(fk.column))})
+            return (qs,
+                    lambda obj: fk.to_python(obj._prefetch_related_val),
+                    lambda obj: fk.to_python(obj._get_pk_val()),
+                    False,
+                    self.prefetch_cache_name)
+
+        def _get_ids(self, objs):
+            "Return the target ids of ``objs`` (instances or primary keys)"
+            from django.db.models import Model
+            ids = set()
+            for obj in objs:
+                if isinstance(obj, self.target.field.rel.to):
+                    if not router.allow_relation(obj, self.instance):
+                       raise ValueError('Cannot add "%r": instance is on database "%s", value is on database "%s"' %
+                                           (obj, self.instance._state.db, obj._state.db))
+                    ids.add(obj.pk)
+                elif isinstance(obj, Model):
+                    raise TypeError("'%s' instance expected" % self.target.field.rel.to._meta.object_name)
+                else:
+                    ids.add(self.target.field.rel.to._meta.pk.to_python(obj))
+            return ids
+
+        def _core_filters(self):
+            return {
+                self.ct_attname: self.content_type_id,
+                self.source.fk_field: self.instance.pk,
+            }
+
+        def iter_chunks(self, size=DEFAULT_CHUNK_SIZE):
+            "Yield the related objects in lists of at most ``size``, one chunk of the through table at a time"
+            db = router.db_for_read(self.instance.__class__, instance=self.instance)
+            rows = self.through._default_manager.using(db).filter(**self._core_filters())
+            return iter_through_chunks(rows, self.target_field_name, superclass.get_query_set(self).using(db), size)
 
-        def _lookup_kwargs(self):
-            return self.through.lookup_kwargs(self.instance)
+        def iterator(self, size=DEFAULT_CHUNK_SIZE):
+            "Iterate over the related objects with flat memory use (see iter_chunks)"
+            for chunk in self.iter_chunks(size):
+                for obj in chunk:
+                    yield obj
 
+        @instrumented('add', write=True)
         def add(self, *objs):
 
-            from django.db.models import Model
             if objs:
-                new_ids = set()
-                for obj in objs:
-                    if isinstance(obj, self.target.field.rel.to):
-                        if not router.allow_relation(obj, self.instance):
-                           raise ValueError('Cannot add "%r": instance is on database "%s", value is on database "%s"' %
-                                               (obj, self.instance._state.db, obj._state.db))
-                        new_ids.add(obj.pk)
-                    elif isinstance(obj, Model):
-                        raise TypeError("'%s' instance expected" % self.target.field.rel.to._meta.object_name)
-                    else:
-                        new_ids.add(obj)
-
-                db = router.db_for_write(self.through.__class__, instance=self.instance)
-                vals = self.through._default_manager.using(db).values_list(self.target_field_name, flat=True)
-                kwargs = {
-                    self.source.ct_field: self.content_type,
-                    self.source.fk_field: self.instance.pk,
-                    '%s__in' % self.target_field_name: new_ids,
-                }
-
-                vals = vals.filter(**kwargs)
-                new_ids = new_ids - set(vals)
-
-                # Add the ones that aren't there already
-                for obj_id in new_ids:
-                   self.through._default_manager.using(db).create(**{
-                       self.source.ct_field: self.content_type,
-                       self.source.fk_field: self.instance.pk,
-                       '%s_id' % self.target_field_name: obj_id,
-                   })
+                new_ids = self._get_ids(objs)
+
+                db = router.db_for_write(self.through, instance=self.instance)
+                with transaction.commit_on_success(using=db):
+                    vals = self.through._default_manager.using(db).values_list(self.target_field_name, flat=True)
+                    kwargs = self._core_filters()
+                    kwargs['%s__in' % self.target_field_name] = new_ids
+
+                    vals = vals.filter(**kwargs)
+                    added = new_ids - set(vals)
+                    self._add_ids(added, db)
+                # once committed, so that no reader caches the previous ids again
+                self._invalidate_cached_ids(added, db)
         add.alters_data = True
 
+        def _invalidate_cached_ids(self, ids, db):
+            if self.field is not None:
+                self.field.invalidate_cached_ids(self.reverse, self.instance, self.model, ids, db)
+
+        def _add_ids(self, new_ids, db):
+            "Insert the through rows for ``new_ids``, one bulk insert per batch"
+            for batch in batches(new_ids, self.batch_size):
+                pk_set = set(batch)
+                m2m_changed.send(sender=self.through, action='pre_add',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=pk_set, using=db)
+                self.through._default_manager.using(db).bulk_create([
+                    self.through(**{
+                        self.ct_attname: self.content_type_id,
+                        self.source.fk_field: self.instance.pk,
+                        '%s_id' % self.target_field_name: obj_id,
+                    })
+                    for obj_id in pk_set
+                ])
+                m2m_changed.send(sender=self.through, action='post_add',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=pk_set, using=db)
+
+        def _remove_ids(self, old_ids, db):
+            "Delete the through rows for ``old_ids`` with a single query"
+            if not old_ids:
+                return
+            m2m_changed.send(sender=self.through, action='pre_remove',
+                instance=self.instance, reverse=self.reverse,
+                model=self.model, pk_set=old_ids, using=db)
+            kwargs = self._core_filters()
+            kwargs['%s__in' % self.target_field_name] = old_ids
+            self.through._default_manager.using(db).filter(**kwargs).delete()
+            m2m_changed.send(sender=self.through, action='post_remove',
+                instance=self.instance, reverse=self.reverse,
+                model=self.model, pk_set=old_ids, using=db)
+
+        @instrumented('set', write=True)
         def set(self, *objs):
-            self.clear()
-            self.add(*objs)
-
+            """
+            Make ``objs`` the related objects, deleting and inserting only
+            the rows that differ from the current ones.
+            """
+            new_ids = self._get_ids(objs)
+
+            db = router.db_for_write(self.through, instance=self.instance)
+            with transaction.commit_on_success(using=db):
+                old_ids = set(self.through._default_manager.using(db).filter(**self._core_filters())
+                    .values_list(self.target_field_name, flat=True))
+                self._remove_ids(old_ids - new_ids, db)
+                self._add_ids(new_ids - old_ids, db)
+            self._invalidate_cached_ids(old_ids ^ new_ids, db)
+        set.alters_data = True
+
+        @instrumented('remove', write=True)
         def remove(self, *objs):
 
             # If there aren't any objects, there is nothing to do.
             if objs:
-                # Check that all the objects are of the right type
                 old_ids = set()
                 for obj in objs:
                     if isinstance(obj, self.target.field.rel.to):
@@ -354,90 +1040,291 @@ def create_genegic_many_related_manager(superclass, through=False):
                     else:
                         old_ids.add(obj)
                 # Remove the specified objects from the join table
-                db = router.db_for_write(self.through.__class__, instance=self.instance)
-                self.through._default_manager.using(db).filter(**{
-                    self.source.ct_field: self.content_type,
-                    self.source.fk_field: self.instance.pk,
-                    '%s__in' % self.target_field_name: old_ids,
-                }).delete()
+                db = router.db_for_write(self.through, instance=self.instance)
+                with transaction.commit_on_success(using=db):
+                    self._remove_ids(old_ids, db)
+                self._invalidate_cached_ids(old_ids, db)
         remove.alters_data = True
 
 
+        @instrumented('clear', write=True)
         def clear(self):
-            self.through.objects.filter(**self._lookup_kwargs()).delete()
+            db = router.db_for_write(self.through, instance=self.instance)
+            rows = self.through._default_manager.using(db).filter(**self._core_filters())
+            old_ids = ()
+            with transaction.commit_on_success(using=db):
+                m2m_changed.send(sender=self.through, action='pre_clear',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=None, using=db)
+                if self.field is not None and self.field.cache_timeout is not None:
+                    old_ids = list(rows.values_list(self.target_field_name, flat=True))
+                rows.delete()
+                m2m_changed.send(sender=self.through, action='post_clear',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=None, using=db)
+            self._invalidate_cached_ids(old_ids, db)
+        clear.alters_data = True
 
     return GenericManyToManyManager
 
 
 def create_many_genegic_related_manager(superclass, through):
     class ManyToManyGenericManager(superclass):
-        def __init__(self, model, instance, source_field_name, target_field_name):
+        def __init__(self, model, instance, source_field_name, target_field_name, prefetch_cache_name=None, field=None, reverse=False):
             self.through = through # generic through model
             self.model = model # source model  
             self.instance = instance  # source instance 
             self.source_field_name = source_field_name # accessor field (link to source)
             self.target_field_name = target_field_name # accessor field (link to target)
+            self.prefetch_cache_name = prefetch_cache_name
+            self._db = None # Manager.__init__ is not called
+            self.field = field
+            self.reverse = reverse
+            self.batch_size = field.batch_size if field is not None else None
+            self.query_strategy = field.query_strategy if field is not None else 'distinct'
             
-            self.content_type = ContentType.objects.db_manager(self.instance._state.db).get_for_model(self.model)
+            self.content_type_id = get_content_type_id(self.model, self.instance._state.db)
             self.source = getattr(self.through, self.source_field_name)
             self.target = getattr(self.through, self.target_field_name)
+            self.ct_attname = self.through._meta.get_field(self.target.ct_field).attname
 
             if not is_gfk_field(self.target):
                 raise TypeError("'%s' (%s) generic foreign key expected" % (self.target_field_name, type(self.target)))
 
+            self.generic_cache_name = '%s_generic' % prefetch_cache_name
+
+        @instrumented('get_query_set')
         def get_query_set(self):
+            try:
+                return self.instance._prefetched_objects_cache[self.prefetch_cache_name]
+            except (AttributeError, KeyError):
+                pass
+
             kwargs = {
-                self.target.ct_field: self.content_type,
+                self.ct_attname: self.content_type_id,
                 self.source_field_name: self.instance
             }
 
             db = self._db = router.db_for_read(self.instance.__class__, instance=self.instance)
-            return superclass.get_query_set(self).using(db).filter(pk__in=self.through._default_manager.using(db).filter(**kwargs).values_list(self.target.fk_field, flat=True)).distinct()
+            qs = superclass.get_query_set(self).using(db)
+            return self._cache_ids(self._filter_related(qs, kwargs, db), qs, self.target.fk_field, db)
+
+        def _filter_related(self, qs, kwargs, db):
+            "Restrict ``qs`` to the objects related to the instance with the field's query strategy"
+            if self.query_strategy == 'distinct':
+                # SELECT DISTINCT target.* FROM target WHERE target.pk IN (SELECT through.fk FROM through WHERE ...)
+                return qs.filter(pk__in=self.through._default_manager.using(db).filter(**kwargs).values_list(self.target.fk_field, flat=True)).distinct()
+            qn = connections[db].ops.quote_name
+            where, params = self._through_conditions(qn)
+            if self.query_strategy == 'join':
+                # SELECT target.* FROM target, through WHERE through.fk = target.pk AND through.ct = %s AND through.source = %s
+                return qs.extra(tables=[self.through._meta.db_table], where=where, params=params)
+            # SELECT target.* FROM target WHERE EXISTS (SELECT 1 FROM through WHERE through.fk = target.pk AND ...)
+            return qs.extra(where=['EXISTS (SELECT 1 FROM %s WHERE %s)' % (qn(self.through._meta.db_table), ' AND '.join(where))],
+                            params=params)
+
+        def _cache_ids(self, qs, targets, id_field, db):
+            "Make ``qs`` read the cached related ids when it is evaluated, if the field caches them"
+            if self.field is None or self.field.cache_timeout is None:
+                return qs
+            qs = related_queryset(qs)
+            rows = self.through._default_manager.using(db).filter(**self._core_filters())
+            qs._cached_ids = (self.field, self.reverse, self.instance, rows, id_field, db, targets)
+            return qs
+
+        def _through_conditions(self, qn):
+            "SQL conditions selecting the through rows of the instance, correlated on the target table"
+            opts = self.through._meta
+            table = qn(opts.db_table)
+            source = opts.get_field(self.source_field_name)
+            where = [
+                '%s.%s = %s.%s' % (table, qn(opts.get_field(self.target.fk_field).column), qn(self.model._meta.db_table), qn(self.model._meta.pk.column)),
+                '%s.%s = %%s' % (table, qn(opts.get_field(self.target.ct_field).column)),
+                '%s.%s = %%s' % (table, qn(source.column)),
+            ]
+            return where, [self.content_type_id, self.instance._get_pk_val()]
+
+        def get_prefetch_query_set(self, instances):
+            """
+            Fetch the targets of all ``instances`` with a single query joined on
+            the through table, annotated with the source id they belong to.
+            """
+            instance = instances[0]
+            db = router.db_for_read(instance.__class__, instance=instance)
+            opts = self.through._meta
+            source = opts.get_field(self.source_field_name)
+            ct = opts.get_field(self.target.ct_field)
+            fk = opts.get_field(self.target.fk_field)
+            ids = list(set(obj._get_pk_val() for obj in instances))
+
+            qn = connections[db].ops.quote_name
+            table = qn(opts.db_table)
+            qs = superclass.get_query_set(self).using(db).extra(
+                tables=[opts.db_table],
+                where=[
+                    '%s.%s = %s.%s' % (table, qn(fk.column), qn(self.model._meta.db_table), qn(self.model._meta.pk.column)),
+                    '%s.%s = %%s' % (table, qn(ct.column)),
+                    '%s.%s IN (%s)' % (table, qn(source.column), ', '.join(['%s'] * len(ids))),
+                ],
+                params=[self.content_type_id] + ids,
+                select={'_prefetch_related_val': '%s.%s' % (table, qn(source.column))},
+            )
+            select_attname = source.rel.get_related_field().get_attname()
+            return (qs,
+                    attrgetter('_prefetch_related_val'),
+                    attrgetter(select_attname),
+                    False,
+                    self.prefetch_cache_name)
+
+
+        def _get_ids(self, objs):
+            "Return the generic object ids of ``objs`` (instances or primary keys)"
+            from django.db.models import Model
+            fk = self.through._meta.get_field(self.target.fk_field)
+            ids = set()
+            for obj in objs:
+                if isinstance(obj, self.model):
+                    if not router.allow_relation(obj, self.instance):
+                       raise ValueError('Cannot add "%r": instance is on database "%s", value is on database "%s"' %
+                                           (obj, self.instance._state.db, obj._state.db))
+                    ids.add(fk.to_python(obj.pk))
+                elif isinstance(obj, Model):
+                    raise TypeError("'%s' instance expected" % self.model._meta.object_name)
+                else:
+                    ids.add(fk.to_python(obj))
+            return ids
 
+        def _core_filters(self):
+            return {
+                self.ct_attname: self.content_type_id,
+                self.source_field_name: self.instance,
+            }
 
+        def iter_chunks(self, size=DEFAULT_CHUNK_SIZE):
+            "Yield the related objects in lists of at most ``size``, one chunk of the through table at a time"
+            db = router.db_for_read(self.instance.__class__, instance=self.instance)
+            rows = self.through._default_manager.using(db).filter(**self._core_filters())
+            return iter_through_chunks(rows, self.target.fk_field, superclass.get_query_set(self).using(db), size)
+
+        def _source_id(self, obj):
+            return getattr(obj, self.through._meta.get_field(self.source_field_name).rel.get_related_field().attname)
+
+        def generic_objects(self):
+            """
+            Return every object linked to the instance through the generic key,
+            whatever its content type, in through table order.
+            """
+            try:
+                return self.instance._prefetched_objects_cache[self.generic_cache_name]
+            except (AttributeError, KeyError):
+                pass
+            db = router.db_for_read(self.instance.__class__, instance=self.instance)
+            rows = self.through._default_manager.using(db).filter(**{self.source_field_name: self.instance})
+            related = fetch_generic_objects(rows, self.target, self.source_field_name, db)
+            return related.get(self._source_id(self.instance), [])
+
+        def prefetch_generic_objects(self, instances):
+            """
+            Load generic_objects() for all ``instances`` at once (1 + one query
+            per content type) and cache the result on each of them.
+            """
+            instances = list(instances)
+            if not instances:
+                return
+            db = router.db_for_read(instances[0].__class__, instance=instances[0])
+            rows = self.through._default_manager.using(db).filter(**{
+                '%s__in' % self.source_field_name: set(self._source_id(obj) for obj in instances),
+            })
+            related = fetch_generic_objects(rows, self.target, self.source_field_name, db)
+            for obj in instances:
+                if not hasattr(obj, '_prefetched_objects_cache'):
+                    obj._prefetched_objects_cache = {}
+                obj._prefetched_objects_cache[self.generic_cache_name] = related.get(self._source_id(obj), [])
+
+        def iterator(self, size=DEFAULT_CHUNK_SIZE):
+            "Iterate over the related objects with flat memory use (see iter_chunks)"
+            for chunk in self.iter_chunks(size):
+                for obj in chunk:
+                    yield obj
+
+        @instrumented('add', write=True)
         def add(self, *objs):
 
-            from django.db.models import Model
             if objs:
-                new_ids = set()
-                for obj in objs:
-                    if isinstance(obj, self.model):
-                        if not router.allow_relation(obj, self.instance):
-                           raise ValueError('Cannot add "%r": instance is on database "%s", value is on database "%s"' %
-                                               (obj, self.instance._state.db, obj._state.db))
-                        new_ids.add(obj.pk)
-                    elif isinstance(obj, Model):
-                        raise TypeError("'%s' instance expected" % self.target.field.rel.to._meta.object_name)
-                    else:
-                        new_ids.add(obj)
-
-                db = router.db_for_write(self.through.__class__, instance=self.instance)
-                vals = self.through._default_manager.using(db).values_list(self.source_field_name, flat=True)
-                kwargs = {
-                    self.source_field_name: self.instance,
-                }
-
-                vals = vals.filter(**kwargs)
-                new_ids = new_ids - set(vals)
-
-                # Add the ones that aren't there already
-                for obj_id in new_ids:
-                   self.through._default_manager.using(db).create(**{
-                       self.target.ct_field: self.content_type,
-                       self.target.fk_field: obj_id,
-                       self.source_field_name: self.instance,
-                   })
+                new_ids = self._get_ids(objs)
+
+                db = router.db_for_write(self.through, instance=self.instance)
+                with transaction.commit_on_success(using=db):
+                    vals = self.through._default_manager.using(db).values_list(self.target.fk_field, flat=True)
+                    kwargs = self._core_filters()
+                    kwargs['%s__in' % self.target.fk_field] = new_ids
+
+                    vals = vals.filter(**kwargs)
+                    added = new_ids - set(vals)
+                    self._add_ids(added, db)
+                # once committed, so that no reader caches the previous ids again
+                self._invalidate_cached_ids(added, db)
         add.alters_data = True
 
+        def _invalidate_cached_ids(self, ids, db):
+            if self.field is not None:
+                self.field.invalidate_cached_ids(self.reverse, self.instance, self.model, ids, db)
+
+        def _add_ids(self, new_ids, db):
+            "Insert the through rows for ``new_ids``, one bulk insert per batch"
+            for batch in batches(new_ids, self.batch_size):
+                pk_set = set(batch)
+                m2m_changed.send(sender=self.through, action='pre_add',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=pk_set, using=db)
+                self.through._default_manager.using(db).bulk_create([
+                    self.through(**{
+                        self.ct_attname: self.content_type_id,
+                        self.target.fk_field: obj_id,
+                        self.source_field_name: self.instance,
+                    })
+                    for obj_id in pk_set
+                ])
+                m2m_changed.send(sender=self.through, action='post_add',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=pk_set, using=db)
+
+        def _remove_ids(self, old_ids, db):
+            "Delete the through rows for ``old_ids`` with a single query"
+            if not old_ids:
+                return
+            m2m_changed.send(sender=self.through, action='pre_remove',
+                instance=self.instance, reverse=self.reverse,
+                model=self.model, pk_set=old_ids, using=db)
+            kwargs = self._core_filters()
+            kwargs['%s__in' % self.target.fk_field] = old_ids
+            self.through._default_manager.using(db).filter(**kwargs).delete()
+            m2m_changed.send(sender=self.through, action='post_remove',
+                instance=self.instance, reverse=self.reverse,
+                model=self.model, pk_set=old_ids, using=db)
+
+        @instrumented('set', write=True)
         def set(self, *objs):
-            self.clear()
-            self.add(*objs)
-
+            """
+            Make ``objs`` the related objects, deleting and inserting only
+            the rows that differ from the current ones.
+            """
+            new_ids = self._get_ids(objs)
+
+            db = router.db_for_write(self.through, instance=self.instance)
+            with transaction.commit_on_success(using=db):
+                old_ids = set(self.through._default_manager.using(db).filter(**self._core_filters())
+                    .values_list(self.target.fk_field, flat=True))
+                self._remove_ids(old_ids - new_ids, db)
+                self._add_ids(new_ids - old_ids, db)
+            self._invalidate_cached_ids(old_ids ^ new_ids, db)
+        set.alters_data = True
+
+        @instrumented('remove', write=True)
         def remove(self, *objs):
 
             # If there aren't any objects, there is nothing to do.
             if objs:
-                # Check that all the objects are of the right type
                 old_ids = set()
                 for obj in objs:
                     if isinstance(obj, self.model):
@@ -445,16 +1332,29 @@ def create_many_genegic_related_manager(superclass, through):
                     else:
                         old_ids.add(obj)
                 # Remove the specified objects from the join table
-                db = router.db_for_write(self.through.__class__, instance=self.instance)
-                self.through._default_manager.using(db).filter(**{
-                    self.target.ct_field: self.content_type,
-                    '%s__in' % self.target.fk_field: old_ids,
-                    self.source_field_name: self.instance.pk,
-                }).delete()
+                db = router.db_for_write(self.through, instance=self.instance)
+                with transaction.commit_on_success(using=db):
+                    self._remove_ids(old_ids, db)
+                self._invalidate_cached_ids(old_ids, db)
         remove.alters_data = True
 
+        @instrumented('clear', write=True)
         def clear(self):
-            self.through.objects.filter(**{self.source_field_name: self.instance}).delete()
+            db = router.db_for_write(self.through, instance=self.instance)
+            rows = self.through._default_manager.using(db).filter(**self._core_filters())
+            old_ids = ()
+            with transaction.commit_on_success(using=db):
+                m2m_changed.send(sender=self.through, action='pre_clear',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=None, using=db)
+                if self.field is not None and self.field.cache_timeout is not None:
+                    old_ids = list(rows.values_list(self.target.fk_field, flat=True))
+                rows.delete()
+                m2m_changed.send(sender=self.through, action='post_clear',
+                    instance=self.instance, reverse=self.reverse,
+                    model=self.model, pk_set=None, using=db)
+            self._invalidate_cached_ids(old_ids, db)
+        clear.alters_data = True
 
     return ManyToManyGenericManager
 
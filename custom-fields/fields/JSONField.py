@@ -1,4 +1,15 @@
-from django.db import models
+from contextlib import contextmanager
+import base64
+import copy
+import hashlib
+import re
+import threading
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import models, router
+from django.db.models.signals import pre_save, post_save
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import simplejson as json
 from django.utils.translation import ugettext_lazy as _
@@ -6,7 +17,170 @@ from django.utils.translation import ugettext_lazy as _
 from django.forms.fields import Field
 from django.forms.util import ValidationError as FormValidationError
 
+class JSONCodec(object):
+    """
+    dumps()/loads() of a json module, called with the keyword arguments of
+    the stdlib json module (``dump_kwargs`` / ``load_kwargs``).
+    """
+    def __init__(self, module, dump_defaults=None):
+        self.module = module
+        self.dump_defaults = dump_defaults or {}
+
+    def dumps(self, value, **kwargs):
+        for key, default in self.dump_defaults.iteritems():
+            kwargs.setdefault(key, default)
+        return self.module.dumps(value, **kwargs)
+
+    def loads(self, value, **kwargs):
+        return self.module.loads(value, **kwargs)
+
+class ForeignJSONCodec(JSONCodec):
+    """
+    Codec of a json module that can't use stdlib encoder classes: ``cls`` is
+    replaced by its ``default`` method, so dates, decimals, ... are encoded
+    exactly like DjangoJSONEncoder does.
+    """
+    def dumps(self, value, **kwargs):
+        cls = kwargs.pop('cls', None)
+        if cls is not None:
+            kwargs.setdefault('default', cls().default)
+        return super(ForeignJSONCodec, self).dumps(value, **kwargs)
+
+def _dump_defaults(module):
+    """
+    Options making the simplejson package (which django.utils.simplejson uses
+    when it is installed) encode Decimals and namedtuples like the stdlib.
+    """
+    try:
+        module.JSONEncoder(use_decimal=False, namedtuple_as_object=False)
+    except TypeError:
+        return {}
+    return {'use_decimal': False, 'namedtuple_as_object': False}
+
+# name -> JSONCodec
+JSON_CODECS = {
+    'django': JSONCodec(json, _dump_defaults(json)),
+}
+
+try:
+    import json as stdlib_json
+except ImportError:
+    pass
+else:
+    JSON_CODECS['json'] = ForeignJSONCodec(stdlib_json)
+
+try:
+    import simplejson
+except ImportError:
+    pass
+else:
+    JSON_CODECS['simplejson'] = ForeignJSONCodec(simplejson, _dump_defaults(simplejson))
+
+def register_codec(name, codec):
+    """Make ``codec`` (a JSONCodec) available as ``JSONField(codec=name)``"""
+    JSON_CODECS[name] = codec
+
+# built in codecs whose module may not be installed
+OPTIONAL_CODECS = ('json', 'simplejson')
+
+def get_codec(name=None):
+    """
+    Return the codec named ``name`` (settings.JSON_FIELD_CODEC by default),
+    or the django one if that backend is not installed.
+    """
+    if name is None:
+        name = getattr(settings, 'JSON_FIELD_CODEC', 'django')
+    try:
+        return JSON_CODECS[name]
+    except KeyError:
+        if name in OPTIONAL_CODECS:
+            return JSON_CODECS['django']
+        raise ImproperlyConfigured("Unknown JSON codec %r, expected one of %s" % (name, ', '.join(sorted(JSON_CODECS))))
+
+_validation = threading.local()
+
+@contextmanager
+def skip_json_validation():
+    """Don't check JSONField schemas in this block (trusted bulk imports)"""
+    previous = getattr(_validation, 'skip', False)
+    _validation.skip = True
+    try:
+        yield
+    finally:
+        _validation.skip = previous
+
+def compile_schema(schema):
+    """
+    Return a function raising ValidationError for the values that don't match
+    ``schema``: a JSON schema (requires the jsonschema package) or a callable
+    used as is.
+    """
+    if callable(schema):
+        return schema
+    try:
+        from jsonschema.validators import validator_for
+    except ImportError:
+        raise ImproperlyConfigured("JSONField(schema=...) requires the jsonschema package")
+    cls = validator_for(schema)
+    cls.check_schema(schema)
+    validator = cls(schema)
+
+    def validate(value):
+        if validator.is_valid(value):
+            return
+        raise ValidationError([error.message for error in validator.iter_errors(value)])
+    return validate
+
+def validate_schema(validator, value):
+    """Run the compiled schema ``validator`` on ``value`` unless validation is skipped"""
+    if validator is not None and not getattr(_validation, 'skip', False):
+        validator(value)
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(text, **load_kwargs):
+    """Decode the items of the JSON array ``text`` one at a time"""
+    load_kwargs = dict(load_kwargs)
+    decoder = load_kwargs.pop('cls', None) or json.JSONDecoder
+    decoder = decoder(**load_kwargs)
+
+    idx = _whitespace.match(text, 0).end()
+    if text[idx:idx + 1] != '[':
+        raise ValueError("Expecting a JSON array")
+    idx = _whitespace.match(text, idx + 1).end()
+    if text[idx:idx + 1] == ']':
+        return
+    while True:
+        item, idx = decoder.raw_decode(text, idx)
+        yield item
+        idx = _whitespace.match(text, idx).end()
+        if text[idx:idx + 1] == ']':
+            return
+        if text[idx:idx + 1] != ',':
+            raise ValueError("Expecting , delimiter: char %d" % idx)
+        idx = _whitespace.match(text, idx + 1).end()
+
+def iter_json_chunks(items, codec, **dump_kwargs):
+    """Encode the iterable ``items`` as a JSON array, one item at a time"""
+    yield u'['
+    for i, item in enumerate(items):
+        if i:
+            yield u', '
+        chunk = codec.dumps(item, **dump_kwargs)
+        yield chunk.decode('utf-8') if isinstance(chunk, str) else chunk
+    yield u']'
+
 class JSONFormField(Field):
+    """
+    Parse the submitted JSON once and return the decoded object, so that
+    JSONField takes it as is instead of parsing the string again.
+    """
+    def __init__(self, *args, **kwargs):
+        self.codec = get_codec(kwargs.pop('codec', None))
+        self.load_kwargs = kwargs.pop('load_kwargs', {})
+        self.schema_validator = kwargs.pop('schema_validator', None)
+        super(JSONFormField, self).__init__(*args, **kwargs)
+
     def clean(self, value):
 
         if not value and not self.required:
@@ -16,50 +190,307 @@ class JSONFormField(Field):
 
         if isinstance(value, basestring):
             try:
-                json.loads(value)
+                decoded = self.codec.loads(value, **self.load_kwargs)
             except ValueError:
                 raise FormValidationError(_("Enter valid JSON"))
+            validate_schema(self.schema_validator, decoded)
+            # a decoded JSON string would be taken for JSON text by the model
+            # field, keep it encoded
+            if not isinstance(decoded, basestring):
+                value = decoded
         return value
 
+# first character of the compressed values, JSON text can't start with it
+COMPRESSED_MARKER = u'#'
+
+class RawJSON(unicode):
+    """JSON text loaded from the database and not decoded yet"""
+
+def fingerprint(value):
+    """Digest of an encoded JSON string, to tell whether it changed"""
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return hashlib.md5(value).digest()
+
+class JSONDescriptor(object):
+    """
+    Decode the JSON strings assigned to the field: immediately, or on first
+    attribute access if the field is lazy.
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            raise AttributeError('Can only be accessed via an instance.')
+        value = obj.__dict__[self.field.name]
+        if isinstance(value, RawJSON):
+            if obj.__dict__.get(self.field.loaded_key) is value:
+                # the raw string is dropped once decoded, keep its digest only
+                obj.__dict__[self.field.loaded_key] = fingerprint(value)
+            value = obj.__dict__[self.field.name] = self.field.decode(value)
+        return value
+
+    def __set__(self, obj, value):
+        if self.field.lazy and isinstance(value, basestring):
+            value = obj.__dict__[self.field.name] = RawJSON(value)
+        else:
+            obj.__dict__[self.field.name] = self.field.decode(value)
+
+        # the first assignment is the one of Model.__init__: remember what was loaded
+        if self.field.loaded_key not in obj.__dict__:
+            if isinstance(value, RawJSON):
+                loaded = value # hashed only if it gets decoded
+            elif isinstance(value, basestring):
+                loaded = fingerprint(value)
+            else:
+                loaded = None
+            obj.__dict__[self.field.loaded_key] = loaded
+
 class JSONField(models.TextField):
     """JSONField is a generic textfield that serializes/unserializes JSON objects"""
 
-    # Used so to_python() is called
-    __metaclass__ = models.SubfieldBase
+    path_fields = ()
 
     def __init__(self, *args, **kwargs):
         self.dump_kwargs = kwargs.pop('dump_kwargs', {'cls': DjangoJSONEncoder})
         self.load_kwargs = kwargs.pop('load_kwargs', {})
+        self.codec_name = kwargs.pop('codec', None)
+        self.codec = get_codec(self.codec_name)
+        # keep the raw string and decode it on first access only
+        self.lazy = kwargs.pop('lazy', False)
+        # store the JSON zlib compressed when longer than this many characters
+        self.compress_threshold = kwargs.pop('compress_threshold', None)
+        self.compress_level = kwargs.pop('compress_level', 6)
+        # JSON schema (or validation function) of the values, compiled in contribute_to_class
+        self.schema = kwargs.pop('schema', None)
+        self.schema_validator = None
+        # 'a.b' paths (or {path: model field}) copied in indexed columns on save
+        self.indexed_paths = kwargs.pop('indexed_paths', ())
 
         super(JSONField, self).__init__(*args, **kwargs)
 
+    def contribute_to_class(self, cls, name):
+        super(JSONField, self).contribute_to_class(cls, name)
+        self.loaded_key = '_%s_loaded' % self.name
+        self.saved_key = '_%s_saved' % self.name
+        self.encoded_key = '_%s_encoded' % self.name
+        if self.schema is not None and self.schema_validator is None:
+            self.schema_validator = compile_schema(self.schema)
+        # Used so to_python() is called
+        setattr(cls, self.name, JSONDescriptor(self))
+        post_save.connect(self._post_save, sender=cls, weak=False)
+        if not cls._meta.abstract:
+            self.add_path_fields(cls)
+
+    def path_field_name(self, path):
+        """Name of the column holding the value at ``path`` ('customer.id' -> 'data_customer_id')"""
+        return '%s_%s' % (self.name, path.replace('.', '_'))
+
+    def add_path_fields(self, cls):
+        """
+        Add an indexed column to ``cls`` for each of the indexed_paths, filled
+        from the JSON value on save. Querysets can then filter on them, e.g.
+        ``filter(data_customer_id='42')``. Only scalars are indexed (objects
+        and arrays are stored as NULL), numbers and booleans in text columns
+        as in the JSON text ('42', 'true'). Note that queryset.update() of the
+        JSON column does not update them.
+        """
+        self.path_fields = []
+        paths = self.indexed_paths
+        if not isinstance(paths, dict):
+            paths = dict((path, None) for path in paths)
+        for i, path in enumerate(sorted(paths)):
+            field = paths[path]
+            if field is None:
+                field = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+            else:
+                field = copy.deepcopy(field)
+            field.editable = False
+            # saved right after this field, once pre_save() updated it
+            field.creation_counter = self.creation_counter + (i + 1) / 1000.0
+            cls.add_to_class(self.path_field_name(path), field)
+            self.path_fields.append((path.split('.'), field))
+
+    def update_path_fields(self, obj, value):
+        """Copy the values at indexed_paths of the JSON ``value`` on ``obj``"""
+        for keys, field in self.path_fields:
+            item = value
+            for key in keys:
+                if isinstance(item, dict):
+                    item = item.get(key)
+                elif isinstance(item, list) and key.isdigit() and int(key) < len(item):
+                    item = item[int(key)]
+                else:
+                    item = None
+                if item is None:
+                    break
+            if isinstance(item, (dict, list)):
+                item = None # only scalars are indexed
+            elif isinstance(item, (bool, int, long, float)) and isinstance(field, (models.CharField, models.TextField)):
+                # written like in the JSON text: 42 -> '42', True -> 'true'
+                item = self.codec.dumps(item, **self.dump_kwargs)
+            try:
+                item = field.to_python(item)
+            except ValidationError:
+                item = None
+            if isinstance(item, basestring) and field.max_length is not None and len(item) > field.max_length:
+                # too long for the column, not indexed
+                item = None
+            setattr(obj, field.attname, item)
+
     def to_python(self, value):
+        """Convert string value to JSON (kept raw for lazy fields, e.g. in loaddata)"""
+        if self.lazy and isinstance(value, basestring):
+            return RawJSON(value)
+        return self.decode(value)
+
+    def decode(self, value):
         """Convert string value to JSON"""
         if isinstance(value, basestring):
+            value = self.decompress(value)
             try:
-                return json.loads(value, **self.load_kwargs)
+                return self.codec.loads(value, **self.load_kwargs)
             except ValueError:
                 pass
         return value
 
+    def get_raw_value(self, obj):
+        """The stored string if the value of ``obj`` was not decoded yet, else None"""
+        value = obj.__dict__.get(self.attname)
+        if isinstance(value, RawJSON):
+            return value
+        return None
+
+    def compress(self, value):
+        """Compress the JSON text ``value`` if it reaches compress_threshold"""
+        if self.compress_threshold is None or len(value) < self.compress_threshold or value.startswith(COMPRESSED_MARKER):
+            return value
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return COMPRESSED_MARKER + base64.b64encode(zlib.compress(value, self.compress_level))
+
+    def decompress(self, value):
+        """Return the JSON text of a stored value, compressed or not"""
+        if not value.startswith(COMPRESSED_MARKER):
+            return value
+        try:
+            return zlib.decompress(base64.b64decode(value[len(COMPRESSED_MARKER):])).decode('utf-8')
+        except (TypeError, zlib.error):
+            # plain text starting with the marker, e.g. '#hashtag'
+            return value
+
+    def encode(self, value):
+        """Convert JSON object to the string stored in the database"""
+        return self.compress(self.codec.dumps(value, **self.dump_kwargs))
+
+    def has_changed(self, obj):
+        """Whether the value of ``obj`` differs from the one it was loaded (or last saved) with"""
+        return self.changed_value(obj) is not None
+
+    def changed_value(self, obj):
+        """
+        The string to store for the value of ``obj`` if it differs from the one
+        it was loaded (or last saved) with, else None.
+        """
+        loaded = obj.__dict__.get(self.loaded_key)
+        raw = self.get_raw_value(obj)
+        if raw is not None:
+            current = raw
+            if raw is loaded:
+                return None
+        else:
+            current = self.encode(getattr(obj, self.attname))
+        if loaded is None:
+            return current
+        if isinstance(loaded, RawJSON):
+            loaded = fingerprint(loaded)
+        if fingerprint(current) == loaded:
+            return None
+        return current
+
+    def pre_save(self, model_instance, add):
+        # the string of changed_value() given by save_json_changes()
+        encoded = model_instance.__dict__.pop(self.encoded_key, None)
+        # untouched lazy values are written back as they were loaded
+        raw = self.get_raw_value(model_instance)
+        if raw is not None:
+            if self.path_fields and raw is not model_instance.__dict__.get(self.loaded_key):
+                self.update_path_fields(model_instance, self.decode(raw))
+            model_instance.__dict__[self.saved_key] = raw
+            return raw
+        value = super(JSONField, self).pre_save(model_instance, add)
+        if self.path_fields:
+            self.update_path_fields(model_instance, value)
+        # encode once here, get_db_prep_value() passes the string through
+        if encoded is None:
+            encoded = self.encode(value)
+        model_instance.__dict__[self.saved_key] = fingerprint(encoded)
+        return encoded
+
+    def _post_save(self, instance, **kwargs):
+        # what was written becomes the reference for has_changed()
+        saved = instance.__dict__.pop(self.saved_key, None)
+        if saved is not None:
+            instance.__dict__[self.loaded_key] = saved
+
     def get_db_prep_value(self, value, connection, prepared=False):
         """Convert JSON object to a string"""
 
         if isinstance(value, basestring):
             return value
-        return json.dumps(value, **self.dump_kwargs)
+        return self.encode(value)
+
+    def iter_items(self, obj):
+        """
+        Iterate over the items of the JSON array of ``obj``. A value not decoded
+        yet is decoded one item at a time, never as a whole document.
+        """
+        raw = self.get_raw_value(obj)
+        if raw is None:
+            return iter(getattr(obj, self.attname) or ())
+        return iter_json_array(self.decompress(raw), **self.load_kwargs)
+
+    def set_items(self, obj, items):
+        """
+        Store the iterable ``items`` as a JSON array on ``obj``, encoding one
+        item at a time: only the resulting string is kept, as a lazy value.
+        """
+        text = u''.join(iter_json_chunks(items, self.codec, **self.dump_kwargs))
+        obj.__dict__[self.attname] = RawJSON(self.compress(text))
+
+    def _get_val_from_obj(self, obj):
+        # serializers get the stored string of the values not decoded yet
+        if obj is not None:
+            raw = self.get_raw_value(obj)
+            if raw is not None:
+                return raw
+        return super(JSONField, self)._get_val_from_obj(obj)
 
     def value_to_string(self, obj):
-        value = self._get_val_from_obj(obj)
-        return self.get_prep_value(value)
+        raw = self.get_raw_value(obj)
+        if raw is not None:
+            return self.decompress(raw)
+        return self.codec.dumps(self._get_val_from_obj(obj), **self.dump_kwargs)
 
     def value_from_object(self, obj):
-        return json.dumps(super(JSONField, self).value_from_object(obj))
+        raw = self.get_raw_value(obj)
+        if raw is not None:
+            return self.decompress(raw)
+        return self.codec.dumps(super(JSONField, self).value_from_object(obj), **self.dump_kwargs)
+
+    def validate(self, value, model_instance):
+        super(JSONField, self).validate(value, model_instance)
+        if value is not None: # allowed by null=True
+            validate_schema(self.schema_validator, value)
 
     def formfield(self, **kwargs):
 
         if "form_class" not in kwargs:
             kwargs["form_class"] = JSONFormField
+            kwargs.setdefault("codec", self.codec_name)
+            kwargs.setdefault("load_kwargs", self.load_kwargs)
+            kwargs.setdefault("schema_validator", self.schema_validator)
 
         field = super(JSONField, self).formfield(**kwargs)
 
@@ -68,3 +499,50 @@ class JSONField(models.TextField):
 
         return field
 
+def json_update_fields(instance):
+    """
+    Names of the loaded fields of ``instance`` to give to
+    ``save(update_fields=...)`` (Django 1.5+, see save_json_changes() before),
+    leaving out the JSONFields that did not change.
+    """
+    names = []
+    for f in instance._meta.fields:
+        if f.primary_key or f.attname not in instance.__dict__:
+            continue
+        if isinstance(f, JSONField) and not f.has_changed(instance):
+            continue
+        names.append(f.name)
+    return names
+
+def save_json_changes(instance, using=None):
+    """
+    Save ``instance`` without writing its JSONFields that did not change: a
+    single UPDATE of its other loaded fields and of the changed JSON values,
+    each encoded once. New (or deleted) instances are saved with save().
+    pre_save and post_save are sent like save() does.
+    Return the names of the updated fields.
+    """
+    using = using or router.db_for_write(instance.__class__, instance=instance)
+    model = instance.__class__
+    if instance._state.adding or instance.pk is None:
+        instance.save(using=using)
+        return [f.name for f in instance._meta.fields]
+
+    pre_save.send(sender=model, instance=instance, raw=False, using=using)
+    values = {}
+    for f in instance._meta.fields:
+        if f.primary_key or f.attname not in instance.__dict__:
+            continue
+        if isinstance(f, JSONField):
+            encoded = f.changed_value(instance)
+            if encoded is None:
+                continue
+            instance.__dict__[f.encoded_key] = encoded # reused by pre_save()
+        values[f.name] = f.pre_save(instance, False)
+    if values and not model._base_manager.using(using).filter(pk=instance.pk).update(**values):
+        # the row is gone: insert it again like save() does
+        instance.save(using=using, force_insert=True)
+        return [f.name for f in instance._meta.fields]
+    instance._state.db = using
+    post_save.send(sender=model, instance=instance, created=False, raw=False, using=using)
+    return sorted(values)
@@ -1,17 +1,118 @@
+import os
+import threading
+
+from django.conf import settings
 from django.db import models
 from django.utils.translation import ugettext_lazy as _
 
 from django.forms.fields import Field
 from django.forms.util import ValidationError as FormValidationError
-from django.template import TemplateSyntaxError
-
-from django.template.loader import get_template
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+
+from django.template.loader import get_template, find_template_loader
+
+_template_index = None
+_template_index_lock = threading.Lock()
+
+def _loader_dirs(loader):
+    """Template directories of ``loader``, or None if its templates can't be listed"""
+    from django.template.loaders import app_directories, cached, filesystem
+    if isinstance(loader, cached.Loader):
+        dirs = []
+        for l in loader.loaders:
+            sub_dirs = _loader_dirs(l)
+            if sub_dirs is None:
+                return None
+            dirs.extend(sub_dirs)
+        return dirs
+    if isinstance(loader, app_directories.Loader):
+        return list(app_directories.app_template_dirs)
+    if isinstance(loader, filesystem.Loader):
+        return list(settings.TEMPLATE_DIRS)
+    return None
+
+def _get_loaders():
+    loaders = []
+    for name in settings.TEMPLATE_LOADERS:
+        loader = find_template_loader(name)
+        if loader is not None:
+            loaders.append(loader)
+    return loaders
+
+def _source_loaders(loaders):
+    """The loaders that can load template sources, cached loaders replaced by their loaders"""
+    from django.template.loaders import cached
+    for loader in loaders:
+        if isinstance(loader, cached.Loader):
+            for l in _source_loaders(loader.loaders):
+                yield l
+        else:
+            yield loader
+
+def get_template_index():
+    """
+    Set of the template paths found in the directories of the configured
+    loaders, built once per process (see invalidate_template_index).
+    """
+    global _template_index
+    index = _template_index
+    if index is not None:
+        return index
+    with _template_index_lock:
+        if _template_index is None:
+            index = set()
+            for loader in _get_loaders():
+                for template_dir in _loader_dirs(loader) or ():
+                    for root, dirs, files in os.walk(template_dir, followlinks=True):
+                        rel_root = os.path.relpath(root, template_dir)
+                        for name in files:
+                            path = name if rel_root == os.curdir else os.path.join(rel_root, name)
+                            index.add(path.replace(os.sep, '/'))
+            _template_index = index
+        return _template_index
+
+def invalidate_template_index(**kwargs):
+    """Forget the template paths, they are listed again on next use"""
+    global _template_index
+    with _template_index_lock:
+        _template_index = None
+
+def template_exists(name):
+    """
+    Whether the loaders can find the template ``name``, without compiling it:
+    a lookup in the template index, then the loaders' sources for the paths
+    it doesn't know (e.g. templates added since, or non-filesystem loaders).
+    """
+    index = get_template_index()
+    if name in index:
+        return True
+    for loader in _source_loaders(_get_loaders()):
+        try:
+            loader.load_template_source(name)
+        except (TemplateDoesNotExist, NotImplementedError):
+            continue
+        with _template_index_lock:
+            index.add(name)
+        return True
+    return False
+
+try:
+    from django.test.signals import setting_changed
+except ImportError:
+    pass
+else:
+    def _setting_changed(setting, **kwargs):
+        if setting in ('TEMPLATE_DIRS', 'TEMPLATE_LOADERS', 'INSTALLED_APPS'):
+            invalidate_template_index()
+    setting_changed.connect(_setting_changed, dispatch_uid='template_field_index')
 
 class TemplateFormField(Field):
     description = "Field to store valide template path"
 
     def __init__(self,*args,**kwargs):
         self.max_length = kwargs.pop('max_length') or 255
+        # compile the template instead of only checking that it exists
+        self.strict = kwargs.pop('strict', False)
         super(TemplateFormField,self).__init__(*args,**kwargs)
     
     def clean(self,value):
@@ -21,20 +122,27 @@ class TemplateFormField(Field):
         value = super(TemplateFormField,self).clean(value)
 
         if isinstance(value, basestring):
+            if not self.strict:
+                if not template_exists(value):
+                    raise FormValidationError(_('Template %s does not existe') % value)
+                return value
             try :
                 get_template(value)
             except TemplateSyntaxError,e:
                 raise FormValidationError('%s' %  e)
-            except:
-                raise FormValidationError(_('Template %s does not existe' % value))
+            except TemplateDoesNotExist:
+                raise FormValidationError(_('Template %s does not existe') % value)
         else:
-            raise FormValidationError(_('Not string instance' % value))
+            raise FormValidationError(_('Not string instance'))
         return value             
 
 class TemplateField(models.CharField):
     """ Field to store valid template path"""
     __metaclass__ = models.SubfieldBase
 
+    def __init__(self, *args, **kwargs):
+        self.strict = kwargs.pop('strict', False)
+        super(TemplateField, self).__init__(*args, **kwargs)
 
     def db_type(self, connection):
         return 'char(%s)' % self.max_length
@@ -60,6 +168,7 @@ class TemplateField(models.CharField):
 
         if "form_class" not in kwargs:
             kwargs["form_class"] = TemplateFormField
+            kwargs.setdefault("strict", self.strict)
 
         field = super(TemplateField, self).formfield(**kwargs)
 
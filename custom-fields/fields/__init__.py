@@ -1,4 +1,4 @@
 from JSONField  import JSONField 
 from TemplateField import TemplateField
-from ContextNameValidator import ContextNameValidator
+from ContextNameValidator import ContextNameValidator, ContextNameField
 from GenericManyToManyField import GenericManyToManyField
@@ -0,0 +1,53 @@
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import get_models
+
+from ...TemplateField import TemplateField, get_template_index, template_exists
+
+class Command(BaseCommand):
+    help = ("Check that every value stored in a TemplateField column still resolves to a "
+            "template, reading each column's distinct values once and checking each path once.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to check. Defaults to the "default" database.'),
+        make_option('--threads', action='store', type='int', dest='threads', default=1,
+            help='Number of threads checking the paths against the template loaders.'),
+    )
+
+    def handle(self, *args, **options):
+        columns = []
+        paths = set()
+        for model in get_models():
+            for f in model._meta.local_fields:
+                if isinstance(f, TemplateField):
+                    values = (model._base_manager.using(options['database']).order_by()
+                              .values_list(f.attname, flat=True).distinct().iterator())
+                    column_paths = set(value for value in values if value)
+                    columns.append(('%s.%s.%s' % (model._meta.app_label, model._meta.object_name, f.name), column_paths))
+                    paths.update(column_paths)
+
+        paths = sorted(paths)
+        get_template_index() # built once, before the threads use it
+        if options['threads'] > 1:
+            pool = ThreadPool(options['threads'])
+            try:
+                found = pool.map(template_exists, paths)
+            finally:
+                pool.close()
+        else:
+            found = map(template_exists, paths)
+        missing = set(path for path, exists in zip(paths, found) if not exists)
+
+        broken = 0
+        for label, column_paths in columns:
+            for path in sorted(column_paths & missing):
+                self.stdout.write("%s: %s\n" % (label, path))
+                broken += 1
+
+        if broken:
+            raise CommandError("%s broken template references (%s distinct paths checked)" % (broken, len(paths)))
+        self.stdout.write("%s distinct template paths checked, no broken reference\n" % len(paths))
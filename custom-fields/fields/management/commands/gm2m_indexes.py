@@ -0,0 +1,162 @@
+from optparse import make_option
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.backends.util import truncate_name
+
+from ...GenericManyToManyField import get_generic_m2m_fields
+
+# Meta.index_together appeared in Django 1.5
+SUPPORTS_INDEX_TOGETHER = django.VERSION >= (1, 5)
+
+class Command(BaseCommand):
+    help = ("Check that the through tables of the GenericManyToManyFields have a unique "
+            "(content type, object id, foreign key) constraint and a (foreign key, content type, "
+            "object id) index, and print the DDL / Meta options to create the missing ones.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to inspect. Defaults to the "default" database.'),
+        make_option('--execute', action='store_true', dest='execute', default=False,
+            help='Create the missing indexes instead of only printing them.'),
+    )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        cursor = connection.cursor()
+        statements = [] # (index name, DDL)
+        existing_names = set()
+        seen = set()
+
+        for model, field in get_generic_m2m_fields():
+            through = field.through
+            if through in seen:
+                continue
+            seen.add(through)
+
+            opts = through._meta
+            gfk, fk = field.get_through_fields()
+            unique_names = (gfk.ct_field, gfk.fk_field, fk.name)
+            index_names = (fk.name, gfk.ct_field, gfk.fk_field)
+            unique_columns = field.through_index_columns()
+            index_columns = (unique_columns[2], unique_columns[0], unique_columns[1])
+
+            has_unique, has_index = self.declared_indexes(opts, unique_names, index_names)
+            existing = self.database_indexes(connection, cursor, opts.db_table)
+            if existing is not None:
+                db_unique, db_index = self.existing_indexes(existing, unique_columns, index_columns)
+                has_unique = has_unique or db_unique
+                has_index = has_index or db_index
+                existing_names.update(name for name, columns, unique in existing)
+
+            label = "%s.%s.%s (%s)" % (model._meta.app_label, model._meta.object_name, field.name, opts.db_table)
+            if has_unique and has_index:
+                self.stdout.write("%s: ok\n" % label)
+                continue
+
+            meta = []
+            qn = connection.ops.quote_name
+            max_length = connection.ops.max_name_length()
+            if not has_unique:
+                meta.append("unique_together = (%r,)" % (unique_names,))
+                name = truncate_name('%s_gm2m_uniq' % opts.db_table, max_length)
+                statements.append((name, "CREATE UNIQUE INDEX %s ON %s (%s);" % (
+                    qn(name), qn(opts.db_table), ', '.join(qn(c) for c in unique_columns))))
+            if not has_index:
+                if SUPPORTS_INDEX_TOGETHER:
+                    meta.append("index_together = (%r,)" % (index_names,))
+                name = truncate_name('%s_gm2m_idx' % opts.db_table, max_length)
+                statements.append((name, "CREATE INDEX %s ON %s (%s);" % (
+                    qn(name), qn(opts.db_table), ', '.join(qn(c) for c in index_columns))))
+            self.stdout.write("%s: missing indexes%s\n" % (label, ", add to %s.Meta:" % opts.object_name if meta else ''))
+            for line in meta:
+                self.stdout.write("    %s\n" % line)
+
+        if not statements:
+            return
+
+        if options['execute']:
+            with transaction.commit_on_success(using=options['database']):
+                for name, sql in statements:
+                    if name in existing_names:
+                        # same name, other columns: left to the user
+                        self.stdout.write("-- skipped, index %s already exists: %s\n" % (name, sql))
+                        continue
+                    cursor.execute(sql.rstrip(';'))
+                    self.stdout.write("%s\n" % sql)
+        else:
+            self.stdout.write("\n-- SQL to create the missing indexes:\n")
+            for name, sql in statements:
+                self.stdout.write("%s\n" % sql)
+
+    def declared_indexes(self, opts, unique_names, index_names):
+        "Whether the through Meta already declares the unique constraint and the index"
+        has_unique = any(set(names) == set(unique_names) for names in opts.unique_together)
+        has_index = False
+        for names in getattr(opts, 'index_together', ()):
+            if tuple(names[:2]) == index_names[:2]:
+                has_index = True
+        return has_unique, has_index
+
+    def database_indexes(self, connection, cursor, table):
+        """
+        [(name, columns, unique)] of the indexes of ``table``: from the
+        introspection's get_constraints() (Django 1.6+), else from the
+        backend's catalog. None when the backend can't be inspected.
+        """
+        introspection = connection.introspection
+        if hasattr(introspection, 'get_constraints'):
+            return [(name, tuple(c['columns'] or ()), c['unique'])
+                    for name, c in introspection.get_constraints(cursor, table).iteritems()
+                    if c['index'] or c['unique']]
+
+        # get_indexes() of Django 1.4 only describes single column indexes
+        qn = connection.ops.quote_name
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA index_list(%s)' % qn(table))
+            indexes = []
+            for row in cursor.fetchall(): # seq, name, unique, ...
+                cursor.execute('PRAGMA index_info(%s)' % qn(row[1]))
+                columns = tuple(info[2] for info in sorted(cursor.fetchall())) # seqno, cid, name
+                indexes.append((row[1], columns, bool(row[2])))
+            return indexes
+        if connection.vendor == 'postgresql':
+            cursor.execute("""
+                SELECT ic.relname, i.indisunique, a.attname
+                FROM pg_index i
+                JOIN pg_class tc ON tc.oid = i.indrelid
+                JOIN pg_class ic ON ic.oid = i.indexrelid
+                CROSS JOIN generate_subscripts(i.indkey, 1) AS k
+                JOIN pg_attribute a ON a.attrelid = tc.oid AND a.attnum = i.indkey[k]
+                WHERE tc.relname = %s AND pg_table_is_visible(tc.oid)
+                ORDER BY ic.relname, k""", [table])
+            rows = [(name, unique, column) for name, unique, column in cursor.fetchall()]
+        elif connection.vendor == 'mysql':
+            cursor.execute('SHOW INDEX FROM %s' % qn(table))
+            # Table, Non_unique, Key_name, Seq_in_index, Column_name, ...
+            rows = [(row[2], not row[1], row[4]) for row in sorted(cursor.fetchall(), key=lambda row: (row[2], row[3]))]
+        elif connection.vendor == 'oracle':
+            cursor.execute("""
+                SELECT ic.index_name, i.uniqueness, LOWER(ic.column_name)
+                FROM user_ind_columns ic JOIN user_indexes i ON i.index_name = ic.index_name
+                WHERE ic.table_name = UPPER(%s)
+                ORDER BY ic.index_name, ic.column_position""", [table])
+            rows = [(name, uniqueness == 'UNIQUE', column) for name, uniqueness, column in cursor.fetchall()]
+        else:
+            return None
+        indexes = {}
+        for name, unique, column in rows:
+            indexes.setdefault(name, (name, [], unique))[1].append(column)
+        return [(name, tuple(columns), unique) for name, columns, unique in indexes.values()]
+
+    def existing_indexes(self, indexes, unique_columns, index_columns):
+        "Whether the ``indexes`` (see database_indexes) contain the unique constraint and the index"
+        has_unique = has_index = False
+        for name, columns, unique in indexes:
+            columns = tuple(c.lower() for c in columns)
+            if unique and set(columns) == set(c.lower() for c in unique_columns):
+                has_unique = True
+            if columns[:2] == tuple(c.lower() for c in index_columns[:2]):
+                has_index = True
+        return has_unique, has_index
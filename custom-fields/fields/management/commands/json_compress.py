@@ -0,0 +1,57 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction, DEFAULT_DB_ALIAS
+from django.db.models import get_models
+
+from ...JSONField import JSONField, COMPRESSED_MARKER
+
+class Command(BaseCommand):
+    args = '[app_label.Model.field ...]'
+    help = ("Compress the stored values of the JSONFields that have a compress_threshold "
+            "(all of them, or the given ones), in batches walked by primary key.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to update. Defaults to the "default" database.'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=500,
+            help='Number of rows read and updated per transaction.'),
+    )
+
+    def handle(self, *labels, **options):
+        fields = []
+        for model in get_models():
+            for f in model._meta.local_fields:
+                if isinstance(f, JSONField) and f.compress_threshold is not None:
+                    label = '%s.%s.%s' % (model._meta.app_label, model._meta.object_name, f.name)
+                    if not labels or label in labels:
+                        fields.append((label, model, f))
+
+        if labels and len(fields) != len(labels):
+            found = set(label for label, model, f in fields)
+            raise CommandError("Unknown or uncompressed JSONField: %s" % ', '.join(l for l in labels if l not in found))
+
+        for label, model, field in fields:
+            count = self.compress_field(model, field, options['database'], options['batch_size'])
+            self.stdout.write("%s: %s rows compressed\n" % (label, count))
+
+    def compress_field(self, model, field, using, batch_size):
+        manager = model._base_manager.using(using)
+        rows = manager.order_by('pk')
+        count = 0
+        last = None
+        while True:
+            chunk = rows if last is None else rows.filter(pk__gt=last)
+            chunk = list(chunk.values_list('pk', field.attname)[:batch_size])
+            if not chunk:
+                return count
+            last = chunk[-1][0]
+
+            with transaction.commit_on_success(using=using):
+                for pk, value in chunk:
+                    if not value or value.startswith(COMPRESSED_MARKER):
+                        continue
+                    compressed = field.compress(value)
+                    if compressed is not value:
+                        manager.filter(pk=pk).update(**{field.attname: compressed})
+                        count += 1
@@ -0,0 +1,75 @@
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from ...GenericManyToManyField import get_generic_m2m_fields
+
+class Command(BaseCommand):
+    help = ("Delete the rows of the GenericManyToManyField through tables whose generic "
+            "foreign key points to a deleted object, walking each table by primary key.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', action='store', dest='database', default=DEFAULT_DB_ALIAS,
+            help='Nominates a database to clean. Defaults to the "default" database.'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+            help='Number of through rows checked (and orphans deleted) per transaction.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+            help='Only count the orphaned rows.'),
+    )
+
+    def handle(self, *args, **options):
+        seen = set()
+        for model, field in get_generic_m2m_fields():
+            if field.through in seen:
+                continue
+            seen.add(field.through)
+
+            count = self.purge_through(field, options['database'], options['batch_size'], options['dry_run'])
+            self.stdout.write("%s.%s.%s (%s): %s orphaned rows%s\n" % (
+                model._meta.app_label, model._meta.object_name, field.name, field.through._meta.db_table,
+                count, '' if options['dry_run'] else ' deleted'))
+
+    def purge_through(self, field, using, batch_size, dry_run):
+        through = field.through
+        gfk, fk = field.get_through_fields()
+        ct_attname = through._meta.get_field(gfk.ct_field).attname
+        manager = through._base_manager.using(using)
+        rows = manager.order_by('pk')
+        count = 0
+        last = None
+        while True:
+            chunk = rows if last is None else rows.filter(pk__gt=last)
+            chunk = list(chunk.values_list('pk', ct_attname, gfk.fk_field)[:batch_size])
+            if not chunk:
+                return count
+            last = chunk[-1][0]
+
+            orphans = self.find_orphans(chunk, using)
+            count += len(orphans)
+            if orphans and not dry_run:
+                with transaction.commit_on_success(using=using):
+                    manager.filter(pk__in=orphans).delete()
+
+    def find_orphans(self, chunk, using):
+        "Return the pks of the through rows of ``chunk`` pointing to missing objects (one query per content type)"
+        rows_by_type = {}
+        for pk, ct_id, obj_id in chunk:
+            rows_by_type.setdefault(ct_id, []).append((pk, obj_id))
+
+        orphans = []
+        for ct_id, rows in rows_by_type.iteritems():
+            try:
+                model = ContentType.objects.db_manager(using).get_for_id(ct_id).model_class()
+            except ContentType.DoesNotExist:
+                model = None
+            if model is None:
+                orphans.extend(pk for pk, obj_id in rows)
+                continue
+            to_python = model._meta.pk.to_python
+            existing = set(model._base_manager.using(using)
+                           .filter(pk__in=set(to_python(obj_id) for pk, obj_id in rows))
+                           .values_list('pk', flat=True))
+            orphans.extend(pk for pk, obj_id in rows if to_python(obj_id) not in existing)
+        return orphans
@@ -0,0 +1,27 @@
+"""
+Run the test suite on an in-memory sqlite database:
+
+    python tests/runtests.py [testapp.TestCase[.test_method] ...]
+"""
+import os
+import sys
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TESTS)
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS), 'custom-fields'))
+
+from django.conf import settings
+
+settings.configure(
+    DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+    INSTALLED_APPS=['django.contrib.contenttypes', 'fields', 'testapp'],
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    TEMPLATE_DIRS=[os.path.join(TESTS, 'templates')],
+    TEMPLATE_LOADERS=[('django.template.loaders.cached.Loader', ['django.template.loaders.filesystem.Loader'])],
+)
+
+from django.test.simple import DjangoTestSuiteRunner
+
+if __name__ == '__main__':
+    failures = DjangoTestSuiteRunner(verbosity=int(os.environ.get("VERBOSITY", 1)), interactive=False, failfast=False).run_tests(sys.argv[1:] or ['testapp'])
+    sys.exit(bool(failures))
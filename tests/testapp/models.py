@@ -0,0 +1,86 @@
+from django.contrib.contenttypes.generic import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from fields import GenericManyToManyField, JSONField, TemplateField, ContextNameField
+
+# the through model points to the field's model with the generic foreign key
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50)
+
+    class Meta:
+        ordering = ('pk',)
+
+class Article(models.Model):
+    title = models.CharField(max_length=100)
+    tags = GenericManyToManyField(Tag, through='TaggedItem')
+
+    class Meta:
+        ordering = ('pk',)
+
+class TaggedItem(models.Model):
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    tag = models.ForeignKey(Tag, related_name='tagged_items')
+
+    class Meta:
+        unique_together = (('content_type', 'object_id', 'tag'),)
+
+class Post(models.Model):
+    title = models.CharField(max_length=100)
+    tags = GenericManyToManyField(Tag, through='CachedTaggedItem', related_name='posts',
+                                  cache_timeout=60, cache_max_ids=3)
+
+    class Meta:
+        ordering = ('pk',)
+
+class CachedTaggedItem(models.Model):
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    tag = models.ForeignKey(Tag, related_name='cached_tagged_items')
+
+# the through model points to the field's model with a foreign key
+
+class Note(models.Model):
+    text = models.CharField(max_length=100)
+
+    class Meta:
+        ordering = ('pk',)
+
+class Folder(models.Model):
+    name = models.CharField(max_length=100)
+    items = GenericManyToManyField(Note, through='FolderItem')
+
+    class Meta:
+        ordering = ('pk',)
+
+class FolderItem(models.Model):
+    folder = models.ForeignKey(Folder, related_name='folder_items')
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+
+    class Meta:
+        unique_together = (('content_type', 'object_id', 'folder'),)
+
+class Variable(models.Model):
+    name = ContextNameField()
+
+class Page(models.Model):
+    template = TemplateField(max_length=255)
+
+def check_order(value):
+    "Schema of Document.order: an object with an integer id"
+    if not isinstance(value, dict) or not isinstance(value.get('id'), (int, long)):
+        raise ValidationError("'id' must be an integer")
+
+class Document(models.Model):
+    data = JSONField(null=True)
+    compressed = JSONField(compress_threshold=20, null=True)
+    lazy = JSONField(lazy=True, null=True)
+    indexed = JSONField(indexed_paths=('customer.id', 'customer.name'), null=True)
+    order = JSONField(schema=check_order, null=True, blank=True)
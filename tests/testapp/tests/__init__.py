@@ -0,0 +1,10 @@
+from testapp.tests.gm2m import *
+from testapp.tests.templates import *
+from testapp.tests.jsonfield import *
+from testapp.tests.cache import *
+from testapp.tests.instrumentation import *
+from testapp.tests.strategies import *
+from testapp.tests.codecs import *
+from testapp.tests.bulk import *
+from testapp.tests.contextname import *
+from testapp.tests.indexes import *
@@ -0,0 +1,46 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.sql import DeleteQuery
+from django.test import TestCase
+
+from testapp.models import Article, TaggedItem, Folder, Note, FolderItem
+from testapp.tests.gm2m import GenericManyToManyTestMixin
+
+class BulkLinkTest(GenericManyToManyTestMixin, TestCase):
+
+    def test_generic_source(self):
+        field = Article._meta.get_field('tags')
+        tags, articles = self.tags, self.articles
+        with self.assertNumQueries(2): # existing links, insert
+            self.assertEqual(field.bulk_link([(a, t) for a in articles[1:] for t in tags]), 7)
+        self.assertEqual(field.bulk_link([(articles[0], tags[0])]), 0)
+        self.assertEqual(list(articles[2].tags.all()), tags)
+        self.assertEqual(field.bulk_unlink([(articles[2], tags[0]), (articles[2], tags[2])]), 2)
+        self.assertEqual(list(articles[2].tags.all()), [tags[1], tags[3]])
+        self.assertEqual(list(articles[0].tags.all()), tags[:3])
+
+    def test_foreign_key_source(self):
+        field = Folder._meta.get_field('items')
+        notes, folders = self.notes, self.folders
+        self.assertEqual(field.bulk_link([(f, n) for f in folders[1:] for n in notes[:2]]), 3)
+        self.assertEqual(field.bulk_unlink([(folders[2], notes[1])]), 1)
+        self.assertEqual(list(folders[2].items.all()), notes[:1])
+        self.assertEqual(list(notes[1].folder_set.all()), folders[:2])
+
+    def test_type_check(self):
+        field = Article._meta.get_field('tags')
+        self.assertRaises(TypeError, field.bulk_link, [(self.articles[0], self.articles[1])])
+
+class PurgeOrphansTest(GenericManyToManyTestMixin, TestCase):
+
+    def test_purge(self):
+        notes = self.notes
+        # notes deleted without the collector (e.g. by another application): orphaned rows
+        DeleteQuery(Note).delete_batch([notes[0].pk, notes[2].pk], DEFAULT_DB_ALIAS)
+        call_command('purge_gm2m_orphans', dry_run=True, batch_size=1, stdout=StringIO())
+        self.assertEqual(FolderItem.objects.count(), 4)
+        call_command('purge_gm2m_orphans', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(FolderItem.objects.values_list('object_id', flat=True)), [notes[1].pk] * 2)
+        self.assertEqual(TaggedItem.objects.count(), 4)
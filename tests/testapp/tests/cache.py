@@ -0,0 +1,109 @@
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed
+from django.test import TestCase
+
+from testapp.models import TaggedItem, Post, CachedTaggedItem
+from testapp.tests.gm2m import GenericManyToManyTestMixin
+
+class RelatedIdsCacheTest(GenericManyToManyTestMixin, TestCase):
+
+    def setUp(self):
+        super(RelatedIdsCacheTest, self).setUp()
+        cache.clear()
+        self.post = Post.objects.create(title='post')
+        self.post.tags.add(*self.tags[:2])
+
+    def assertTags(self, post, tags):
+        self.assertEqual(list(post.tags.all()), tags)
+
+    def test_hit_skips_through_table(self):
+        with self.assertNumQueries(2):
+            self.assertTags(self.post, self.tags[:2])
+        with self.assertNumQueries(1):
+            self.assertTags(self.post, self.tags[:2])
+        with self.assertNumQueries(1):
+            self.assertTags(self.post, self.tags[:2])
+
+    def test_read_on_evaluation(self):
+        with self.assertNumQueries(0):
+            qs = self.post.tags.all()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.post.tags.exists())
+        self.assertTags(self.post, self.tags[:2])
+        # querysets derived from the manager's run the query strategy
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.post.tags.filter(pk=self.tags[1].pk)), self.tags[1:2])
+
+    def test_prefetch(self):
+        posts = [self.post] + [Post.objects.create(title='post %s' % i) for i in range(4)]
+        posts[1].tags.add(*self.tags[1:4])
+        with self.assertNumQueries(2):
+            prefetched = [list(p.tags.all()) for p in Post.objects.prefetch_related('tags')]
+        self.assertEqual([sorted(t.pk for t in tags) for tags in prefetched],
+                         [sorted(t.pk for t in p.tags.all()) for p in posts])
+
+    def test_reverse(self):
+        self.assertEqual(list(self.tags[0].posts.all()), [self.post])
+        other = Post.objects.create(title='other')
+        other.tags.add(self.tags[0])
+        self.assertEqual(list(self.tags[0].posts.all()), [self.post, other])
+        self.tags[0].posts.remove(self.post)
+        self.assertTags(self.post, self.tags[1:2])
+
+    def test_writes_invalidate(self):
+        self.assertTags(self.post, self.tags[:2])
+        self.assertEqual(list(self.tags[2].posts.all()), [])
+        self.post.tags.add(self.tags[2])
+        self.assertTags(self.post, self.tags[:3])
+        self.assertEqual(list(self.tags[2].posts.all()), [self.post])
+        self.post.tags.remove(self.tags[0])
+        self.assertTags(self.post, self.tags[1:3])
+        self.assertEqual(list(self.tags[0].posts.all()), [])
+        self.post.tags.set(self.tags[3])
+        self.assertTags(self.post, self.tags[3:4])
+        self.assertEqual(list(self.tags[1].posts.all()), [])
+        self.post.tags.clear()
+        self.assertTags(self.post, [])
+        self.assertEqual(list(self.tags[3].posts.all()), [])
+
+    def test_through_row_deletion_invalidates(self):
+        self.assertTags(self.post, self.tags[:2])
+        CachedTaggedItem.objects.filter(tag=self.tags[0]).delete()
+        self.assertTags(self.post, self.tags[1:2])
+
+    def test_too_many_ids(self):
+        self.post.tags.add(*self.tags[2:])
+        self.assertTags(self.post, self.tags)
+        # the set is too large: only the marker is cached, no through query on its own
+        with self.assertNumQueries(1):
+            self.assertTags(self.post, self.tags)
+        self.post.tags.remove(*self.tags[3:])
+        self.assertTags(self.post, self.tags[:3])
+        with self.assertNumQueries(1):
+            self.assertTags(self.post, self.tags[:3])
+
+class ClearTest(GenericManyToManyTestMixin, TestCase):
+
+    def test_clear(self):
+        article, other = self.articles[:2]
+        actions = []
+        def receiver(action, **kwargs):
+            actions.append(action)
+        m2m_changed.connect(receiver, sender=TaggedItem)
+        try:
+            article.tags.clear()
+        finally:
+            m2m_changed.disconnect(receiver, sender=TaggedItem)
+        self.assertEqual(actions, ['pre_clear', 'post_clear'])
+        self.assertEqual(list(article.tags.all()), [])
+        self.assertEqual(list(other.tags.all()), self.tags[1:2])
+        self.tags[1].article_set.clear()
+        self.assertEqual(list(other.tags.all()), [])
+
+    def test_clear_foreign_key_source(self):
+        folder, other = self.folders[:2]
+        folder.items.clear()
+        self.assertEqual(list(folder.items.all()), [])
+        self.assertEqual(list(other.items.all()), self.notes[1:2])
+        self.notes[1].folder_set.clear()
+        self.assertEqual(list(other.items.all()), [])
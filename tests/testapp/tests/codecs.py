@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from datetime import date, datetime, time
+from decimal import Decimal
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import TestCase
+from django.utils import simplejson as json
+
+from fields.JSONField import JSON_CODECS, JSONFormField, get_codec
+
+from testapp.models import Document
+
+Point = namedtuple('Point', 'x y')
+
+SAMPLE = {
+    'int': 1, 'float': 1.5, 'bool': True, 'none': None,
+    'text': u'caf\xe9 ☃', 'list': [1, [2, {'a': 'b'}]],
+    'decimal': Decimal('1.10'), 'date': date(2020, 1, 2),
+    'datetime': datetime(2020, 1, 2, 3, 4, 5, 123456), 'time': time(1, 2, 3),
+    'namedtuple': Point(1, 2),
+}
+
+# how DjangoJSONEncoder encodes SAMPLE
+EXPECTED = {
+    'int': 1, 'float': 1.5, 'bool': True, 'none': None,
+    'text': u'caf\xe9 ☃', 'list': [1, [2, {'a': 'b'}]],
+    'decimal': '1.10', 'date': '2020-01-02',
+    'datetime': '2020-01-02T03:04:05.123', 'time': '01:02:03',
+    'namedtuple': [1, 2],
+}
+
+class CodecMatrixTest(TestCase):
+    """Every installed codec encodes and decodes like the django one"""
+
+    def codecs(self):
+        self.assertIn('django', JSON_CODECS)
+        return sorted(JSON_CODECS.items())
+
+    def test_encode(self):
+        reference = get_codec('django').dumps(SAMPLE, cls=DjangoJSONEncoder, sort_keys=True)
+        self.assertEqual(json.loads(reference), EXPECTED)
+        for name, codec in self.codecs():
+            text = codec.dumps(SAMPLE, cls=DjangoJSONEncoder, sort_keys=True)
+            self.assertEqual(json.loads(text), EXPECTED, name)
+            self.assertEqual(text, reference, name)
+
+    def test_decode(self):
+        text = get_codec('django').dumps(SAMPLE, cls=DjangoJSONEncoder)
+        for name, codec in self.codecs():
+            self.assertEqual(codec.loads(text), EXPECTED, name)
+            self.assertEqual(codec.loads(text, parse_float=Decimal)['float'], Decimal('1.5'), name)
+
+    def test_unsupported_type(self):
+        # like DjangoJSONEncoder itself, no codec encodes UUIDs
+        for name, codec in self.codecs():
+            self.assertRaises(TypeError, codec.dumps, uuid.uuid4(), cls=DjangoJSONEncoder)
+
+    def test_field(self):
+        field = Document._meta.get_field('data')
+        codec = field.codec
+        try:
+            for name, field.codec in self.codecs():
+                doc = Document.objects.create(data=SAMPLE)
+                self.assertEqual(Document.objects.get(pk=doc.pk).data, EXPECTED, name)
+        finally:
+            field.codec = codec
+
+    def test_form_field(self):
+        text = json.dumps(EXPECTED)
+        for name, codec in self.codecs():
+            self.assertEqual(JSONFormField(codec=name).clean(text), EXPECTED, name)
+
+    def test_fallback(self):
+        codec = JSON_CODECS.pop('simplejson', None)
+        try:
+            self.assertIs(get_codec('simplejson'), JSON_CODECS['django']) # not installed
+        finally:
+            if codec is not None:
+                JSON_CODECS['simplejson'] = codec
+        with self.settings(JSON_FIELD_CODEC='json'):
+            self.assertIs(get_codec(), JSON_CODECS['json'])
+
+    def test_unknown(self):
+        self.assertRaises(ImproperlyConfigured, get_codec, 'simplejosn')
+        with self.settings(JSON_FIELD_CODEC='simplejosn'):
+            self.assertRaises(ImproperlyConfigured, JSONFormField)
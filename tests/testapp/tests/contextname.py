@@ -0,0 +1,37 @@
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+
+from fields import ContextNameValidator
+
+from testapp.models import Variable
+
+VALID = ['ab', '_x', 'a1', 'A_b_2', '__']
+INVALID = ['', 'a', '1ab', 'ab cd', 'ab\n', 'a-b', ' ab', 'ab.c']
+
+class ContextNameTest(TestCase):
+
+    def test_validator(self):
+        for name in VALID:
+            self.assertEqual(ContextNameValidator(name), name)
+        for name in INVALID:
+            self.assertRaises(ValidationError, ContextNameValidator, name)
+
+    def test_validate_many(self):
+        values = VALID + INVALID + [None, 12, ['ab']]
+        self.assertEqual(ContextNameValidator.validate_many(values), range(len(VALID), len(values)))
+        self.assertEqual(ContextNameValidator.validate_many([]), [])
+
+    def test_model_field(self):
+        Variable(name='_x').full_clean()
+        for name in ('1ab', 'ab cd'):
+            try:
+                Variable(name=name).full_clean()
+            except ValidationError, e:
+                self.assertEqual(e.message_dict.keys(), ['name'])
+            else:
+                self.fail(name)
+
+    def test_form_field(self):
+        form_field = Variable._meta.get_field('name').formfield()
+        self.assertEqual(form_field.clean('ab_1'), 'ab_1')
+        self.assertRaises(ValidationError, form_field.clean, 'ab\n1')
@@ -0,0 +1,111 @@
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+
+from testapp.models import Article, Tag, TaggedItem, Folder, Note, FolderItem
+
+class GenericManyToManyTestMixin(object):
+
+    def setUp(self):
+        self.tags = [Tag.objects.create(name='tag %s' % i) for i in range(4)]
+        self.articles = [Article.objects.create(title='article %s' % i) for i in range(3)]
+        self.articles[0].tags.add(*self.tags[:3])
+        self.articles[1].tags.add(self.tags[1])
+        self.notes = [Note.objects.create(text='note %s' % i) for i in range(4)]
+        self.folders = [Folder.objects.create(name='folder %s' % i) for i in range(3)]
+        self.folders[0].items.add(*self.notes[:3])
+        self.folders[1].items.add(self.notes[1])
+
+class DeletionTest(GenericManyToManyTestMixin, TestCase):
+
+    def test_delete_generic_source(self):
+        self.articles[0].delete()
+        self.assertEqual(list(TaggedItem.objects.values_list('object_id', 'tag')), [(self.articles[1].pk, self.tags[1].pk)])
+        self.assertEqual(list(self.articles[1].tags.all()), self.tags[1:2])
+
+    def test_delete_foreign_key_source(self):
+        folder, other = self.folders[:2]
+        # rows pointing to the note with the same pk must not be mixed up
+        self.assertEqual(other.pk, self.notes[1].pk)
+        other.delete()
+        self.assertEqual(list(FolderItem.objects.values_list('folder', 'object_id')),
+                         [(folder.pk, note.pk) for note in self.notes[:3]])
+        self.assertEqual(list(folder.items.all()), self.notes[:3])
+
+    def test_delete_foreign_key_target(self):
+        notes = self.notes
+        notes[0].delete()
+        Note.objects.filter(pk=notes[2].pk).delete()
+        self.assertEqual(list(FolderItem.objects.values_list('object_id', flat=True)), [notes[1].pk] * 2)
+        self.assertEqual(list(self.folders[0].items.all()), notes[1:2])
+
+    def test_delete_generic_target(self):
+        self.tags[1].delete()
+        self.assertEqual(list(self.articles[0].tags.all()), [self.tags[0], self.tags[2]])
+        self.assertEqual(list(self.articles[1].tags.all()), [])
+
+class PrefetchTest(GenericManyToManyTestMixin, TestCase):
+
+    def assertPrefetched(self, queryset, accessor):
+        expected = dict((obj.pk, list(getattr(obj, accessor).all())) for obj in queryset)
+        with self.assertNumQueries(2):
+            prefetched = dict((obj.pk, list(getattr(obj, accessor).all()))
+                              for obj in queryset.prefetch_related(accessor))
+        pks = lambda objs: dict((pk, sorted(obj.pk for obj in related)) for pk, related in objs.items())
+        self.assertEqual(pks(prefetched), pks(expected))
+
+    def test_generic_source(self):
+        self.assertPrefetched(Article.objects.all(), 'tags')
+
+    def test_generic_source_reverse(self):
+        self.assertPrefetched(Tag.objects.all(), 'article_set')
+
+    def test_foreign_key_source(self):
+        self.assertPrefetched(Folder.objects.all(), 'items')
+
+    def test_foreign_key_source_reverse(self):
+        self.assertPrefetched(Note.objects.all(), 'folder_set')
+
+class IteratorTest(GenericManyToManyTestMixin, TestCase):
+
+    def test_iterator(self):
+        self.assertEqual(list(self.articles[0].tags.iterator(size=2)), self.tags[:3])
+        self.assertEqual(list(self.tags[1].article_set.iterator(size=1)), self.articles[:2])
+        self.assertEqual(list(self.folders[0].items.iterator(size=2)), self.notes[:3])
+        self.assertEqual(list(self.notes[1].folder_set.iterator(size=1)), self.folders[:2])
+
+    def test_iter_chunks(self):
+        self.assertEqual(list(self.articles[0].tags.iter_chunks(size=2)), [self.tags[:2], self.tags[2:3]])
+        self.assertEqual(list(self.articles[2].tags.iter_chunks()), [])
+
+class GenericObjectsTest(GenericManyToManyTestMixin, TestCase):
+
+    def setUp(self):
+        super(GenericObjectsTest, self).setUp()
+        # the folders also hold objects of other content types
+        for folder, objs in ((self.folders[0], [self.tags[0], self.notes[3], self.articles[1]]),
+                             (self.folders[2], [self.articles[0], self.tags[1]])):
+            for obj in objs:
+                FolderItem.objects.create(folder=folder, content_object=obj)
+        self.expected = {
+            self.folders[0].pk: self.notes[:3] + [self.tags[0], self.notes[3], self.articles[1]],
+            self.folders[1].pk: [self.notes[1]],
+            self.folders[2].pk: [self.articles[0], self.tags[1]],
+        }
+        for model in (Note, Tag, Article):
+            ContentType.objects.get_for_model(model)
+
+    def test_generic_objects(self):
+        with self.assertNumQueries(1 + 3): # through rows, then one query per content type
+            objs = self.folders[0].items.generic_objects()
+        self.assertEqual(objs, self.expected[self.folders[0].pk])
+        self.assertEqual(self.folders[1].items.generic_objects(), self.expected[self.folders[1].pk])
+        # items keeps returning the objects of the field's model only
+        self.assertEqual(list(self.folders[0].items.all()), self.notes)
+
+    def test_prefetch(self):
+        folders = list(Folder.objects.all())
+        with self.assertNumQueries(1 + 3):
+            folders[0].items.prefetch_generic_objects(folders)
+        with self.assertNumQueries(0):
+            objs = dict((folder.pk, folder.items.generic_objects()) for folder in folders)
+        self.assertEqual(objs, self.expected)
@@ -0,0 +1,35 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+class IndexCommandTest(TestCase):
+
+    def tearDown(self):
+        # sqlite commits before DDL: drop the indexes created by --execute
+        cursor = connection.cursor()
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE '%%_gm2m_%%'")
+        for name, in cursor.fetchall():
+            cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+
+    def run_command(self, **options):
+        out = StringIO()
+        call_command('gm2m_indexes', stdout=out, **options)
+        return out.getvalue()
+
+    def test_report(self):
+        out = self.run_command()
+        self.assertIn('testapp.Post.tags (testapp_cachedtaggeditem): missing indexes, add to CachedTaggedItem.Meta:', out)
+        self.assertIn("unique_together = (('content_type', 'object_id', 'tag'),)", out)
+        # Django 1.4 rejects Meta.index_together
+        self.assertNotIn('index_together', out)
+        self.assertIn('CREATE INDEX "testapp_taggeditem_gm2m_idx" ON "testapp_taggeditem" ("tag_id", "content_type_id", "object_id");', out)
+
+    def test_execute_twice(self):
+        self.assertIn('CREATE UNIQUE INDEX', self.run_command(execute=True))
+        # the database is inspected: nothing left to create
+        out = self.run_command(execute=True)
+        self.assertNotIn('CREATE', out)
+        self.assertNotIn('missing', out)
+        self.assertIn('testapp.Article.tags (testapp_taggeditem): ok', out)
@@ -0,0 +1,60 @@
+from django.test import TestCase
+
+from fields.GenericManyToManyField import register_sink, unregister_sink, set_sample_rate
+
+from testapp.models import Article
+from testapp.tests.gm2m import GenericManyToManyTestMixin
+
+class InstrumentationTest(GenericManyToManyTestMixin, TestCase):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.article = self.articles[2] # no tags yet
+        self.records = []
+        self.sink = lambda **record: self.records.append(record)
+        register_sink(self.sink)
+
+    def tearDown(self):
+        unregister_sink(self.sink)
+        set_sample_rate(1.0)
+
+    def operations(self):
+        return [(r['operation'], r['ids'], r['queries']) for r in self.records]
+
+    def test_writes(self):
+        tags = self.article.tags
+        del self.records[:]
+        tags.add(*self.tags)
+        tags.remove(self.tags[0])
+        tags.clear()
+        self.assertEqual([op for op, ids, queries in self.operations()], ['add', 'remove', 'clear'])
+        self.assertEqual(self.records[0]['ids'], 4)
+        self.assertTrue(all(queries > 0 for op, ids, queries in self.operations()))
+        self.assertEqual(self.records[0]['field'], Article._meta.get_field('tags'))
+        self.assertFalse(self.records[0]['reverse'])
+
+    def test_query_set_reported_on_evaluation(self):
+        self.article.tags.add(*self.tags)
+        qs = self.article.tags.all()
+        del self.records[:]
+        qs = qs.filter(pk__gt=self.tags[0].pk)
+        self.assertEqual(self.records, [])
+        self.assertEqual(list(qs), self.tags[1:])
+        self.assertEqual(self.operations(), [('get_query_set', 3, 1)])
+        self.assertTrue(self.records[0]['elapsed'] >= 0)
+
+    def test_descriptor_access(self):
+        del self.records[:]
+        self.tags[0].article_set
+        self.assertEqual([(r['operation'], r['reverse']) for r in self.records], [('access', True)])
+
+    def test_disabled(self):
+        unregister_sink(self.sink)
+        self.article.tags.add(self.tags[0])
+        list(self.article.tags.all())
+        self.assertEqual(self.records, [])
+
+    def test_sample_rate(self):
+        set_sample_rate(0)
+        self.article.tags.add(self.tags[0])
+        self.assertEqual(self.records, [])
@@ -0,0 +1,191 @@
+from django.core import serializers
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase
+from django.utils import simplejson as json
+
+from fields.JSONField import JSONField, COMPRESSED_MARKER, save_json_changes, skip_json_validation
+
+from testapp.models import Document
+
+class CompressionTest(TestCase):
+
+    def stored(self, doc, name):
+        cursor = connection.cursor()
+        cursor.execute('SELECT %s FROM testapp_document WHERE id = %%s' % name, [doc.pk])
+        return cursor.fetchone()[0]
+
+    def test_compressed(self):
+        value = {'items': range(50)}
+        doc = Document.objects.create(compressed=value)
+        self.assertTrue(self.stored(doc, 'compressed').startswith(COMPRESSED_MARKER))
+        self.assertEqual(Document.objects.get(pk=doc.pk).compressed, value)
+
+    def test_short_value_not_compressed(self):
+        doc = Document.objects.create(compressed=[1])
+        self.assertEqual(self.stored(doc, 'compressed'), '[1]')
+        self.assertEqual(Document.objects.get(pk=doc.pk).compressed, [1])
+
+    def test_marker_text_without_compression(self):
+        # plain text stored before JSONField, starting with the compression marker
+        doc = Document.objects.create()
+        Document.objects.filter(pk=doc.pk).update(data='#hashtag', lazy='#hashtag')
+        doc = Document.objects.get(pk=doc.pk)
+        self.assertEqual(doc.data, '#hashtag')
+        self.assertEqual(doc.lazy, '#hashtag')
+
+    def test_compressed_without_threshold(self):
+        # stored before compress_threshold was removed from the field
+        doc = Document.objects.create(compressed={'items': range(50)})
+        Document.objects.filter(pk=doc.pk).update(data=self.stored(doc, 'compressed'))
+        self.assertEqual(Document.objects.get(pk=doc.pk).data, {'items': range(50)})
+
+    def test_marker_text_with_compression(self):
+        doc = Document.objects.create()
+        Document.objects.filter(pk=doc.pk).update(compressed='#hashtag')
+        self.assertEqual(Document.objects.get(pk=doc.pk).compressed, '#hashtag')
+
+class SerializationTest(TestCase):
+
+    def test_dumpdata_roundtrip(self):
+        value = {'a': [1, u'\xe9'], 'b': {'c': None}}
+        doc = Document.objects.create(data=value, compressed={'items': range(50)}, lazy=value)
+        for obj in (doc, Document.objects.get(pk=doc.pk)):
+            fields = json.loads(serializers.serialize('json', [obj]))[0]['fields']
+            self.assertEqual(json.loads(fields['data']), value)
+            self.assertEqual(json.loads(fields['compressed']), {'items': range(50)})
+            self.assertEqual(json.loads(fields['lazy']), value)
+
+            loaded = list(serializers.deserialize('json', serializers.serialize('json', [obj])))[0].object
+            self.assertEqual(loaded.data, value)
+            self.assertEqual(loaded.compressed, {'items': range(50)})
+            self.assertEqual(loaded.lazy, value)
+
+class IndexedPathsTest(TestCase):
+
+    def test_path_fields(self):
+        doc = Document.objects.create(indexed={'customer': {'id': 42, 'name': 'x' * 300}})
+        self.assertEqual(doc.indexed_customer_id, u'42')
+        self.assertEqual(doc.indexed_customer_name, None) # longer than the column
+        self.assertEqual(list(Document.objects.filter(indexed_customer_id='42')), [doc])
+
+        doc.indexed = {'customer': {'name': 'short'}}
+        doc.save()
+        doc = Document.objects.get(pk=doc.pk)
+        self.assertEqual(doc.indexed_customer_id, None)
+        self.assertEqual(doc.indexed_customer_name, u'short')
+
+    def test_scalars_only(self):
+        values = [({'a': 1}, None), ([1], None), (True, u'true'), (False, u'false'),
+                  (1.5, u'1.5'), (7, u'7'), (u'caf\xe9', u'caf\xe9'), (None, None)]
+        for value, stored in values:
+            doc = Document.objects.create(indexed={'customer': {'id': value}})
+            self.assertEqual(Document.objects.get(pk=doc.pk).indexed_customer_id, stored, value)
+        self.assertEqual(Document.objects.filter(indexed_customer_id='true').count(), 1)
+
+class SaveChangesTest(TestCase):
+
+    def setUp(self):
+        doc = Document.objects.create(data={'a': 1}, lazy=[1, 2], indexed={'customer': {'id': 1}})
+        self.doc = Document.objects.get(pk=doc.pk)
+
+    def updates(self, doc):
+        "Columns written by save_json_changes(doc)"
+        connection.use_debug_cursor = True
+        start = len(connection.queries)
+        try:
+            save_json_changes(doc)
+            queries = connection.queries[start:]
+        finally:
+            connection.use_debug_cursor = None
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql'].split(' WHERE ')[0]
+        return sorted(f.column for f in Document._meta.fields if '"%s" =' % f.column in sql)
+
+    def test_unchanged_json_not_written(self):
+        self.assertFalse(Document._meta.get_field('data').has_changed(self.doc))
+        self.assertEqual(self.updates(self.doc), ['indexed_customer_id', 'indexed_customer_name'])
+
+    def test_changed_json_written(self):
+        self.doc.data['b'] = 2
+        self.doc.lazy # decoded, not changed
+        self.assertEqual(self.updates(self.doc), ['data', 'indexed_customer_id', 'indexed_customer_name'])
+        self.assertEqual(Document.objects.get(pk=self.doc.pk).data, {'a': 1, 'b': 2})
+        self.assertFalse(Document._meta.get_field('data').has_changed(self.doc))
+
+    def test_encoded_once(self):
+        field = Document._meta.get_field('indexed')
+        calls = []
+        def encode(value):
+            calls.append(value)
+            return JSONField.encode(field, value)
+        field.encode = encode
+        try:
+            self.doc.indexed = {'customer': {'id': 2}}
+            save_json_changes(self.doc)
+        finally:
+            del field.encode
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(list(Document.objects.filter(indexed_customer_id='2')), [self.doc])
+
+    def test_new_instance(self):
+        doc = Document(data=[1])
+        save_json_changes(doc)
+        self.assertEqual(Document.objects.get(pk=doc.pk).data, [1])
+
+class SchemaTest(TestCase):
+
+    def errors(self, order):
+        doc = Document(data=[1], compressed=[1], lazy=[1], indexed=[1], order=order)
+        try:
+            doc.full_clean()
+        except ValidationError, e:
+            return e.message_dict
+        return {}
+
+    def test_full_clean(self):
+        self.assertEqual(self.errors({'id': 1}), {})
+        self.assertEqual(self.errors({'id': 'x'}), {'order': ["'id' must be an integer"]})
+        self.assertEqual(self.errors(None), {})
+
+    def test_null(self):
+        field = Document._meta.get_field('order')
+        self.assertEqual(field.clean(None, Document()), None)
+
+    def test_form_field(self):
+        form_field = Document._meta.get_field('order').formfield()
+        self.assertEqual(form_field.clean('{"id": 1}'), {'id': 1})
+        self.assertRaises(ValidationError, form_field.clean, '{"id": "x"}')
+        self.assertEqual(form_field.clean(''), None)
+
+    def test_skip_validation(self):
+        form_field = Document._meta.get_field('order').formfield()
+        with skip_json_validation():
+            self.assertEqual(self.errors({'id': 'x'}), {})
+            self.assertEqual(form_field.clean('{"id": "x"}'), {'id': 'x'})
+        self.assertEqual(self.errors({'id': 'x'}).keys(), ['order'])
+
+class ItemsTest(TestCase):
+
+    def test_iter_items(self):
+        items = [{'id': i} for i in range(30)]
+        doc = Document.objects.create(data=items, compressed=items, lazy=items)
+        doc = Document.objects.get(pk=doc.pk)
+        for name in ('data', 'compressed', 'lazy'):
+            field = Document._meta.get_field(name)
+            self.assertEqual(list(field.iter_items(doc)), items, name)
+        # lazy values are not decoded as a whole
+        self.assertTrue(Document._meta.get_field('lazy').get_raw_value(doc) is not None)
+        self.assertEqual(list(Document._meta.get_field('lazy').iter_items(Document(lazy=None))), [])
+
+    def test_set_items(self):
+        doc = Document.objects.create(data=[0])
+        items = [{'id': i} for i in range(30)]
+        for name in ('data', 'compressed', 'lazy'):
+            Document._meta.get_field(name).set_items(doc, iter(items))
+        self.assertTrue(doc.__dict__['compressed'].startswith(COMPRESSED_MARKER))
+        for name in ('data', 'compressed'):
+            self.assertEqual(list(Document._meta.get_field(name).iter_items(doc)), items, name)
+        doc.save()
+        doc = Document.objects.get(pk=doc.pk)
+        self.assertEqual((doc.data, doc.compressed, doc.lazy), (items, items, items))
@@ -0,0 +1,59 @@
+from django.test import TestCase
+
+from fields.GenericManyToManyField import QUERY_STRATEGIES
+
+from testapp.models import Article, Folder
+from testapp.tests.gm2m import GenericManyToManyTestMixin
+
+class QueryStrategyTest(GenericManyToManyTestMixin, TestCase):
+    """The three query strategies select the same rows"""
+
+    def setUp(self):
+        super(QueryStrategyTest, self).setUp()
+        self.articles[1].tags.add(*self.tags[2:])
+        self.folders[1].items.add(*self.notes[2:])
+
+    def tearDown(self):
+        for model, name in ((Article, 'tags'), (Folder, 'items')):
+            model._meta.get_field(name).query_strategy = 'distinct'
+
+    def rows(self, field, instances, accessor):
+        rows = {}
+        for strategy in QUERY_STRATEGIES:
+            field.query_strategy = strategy
+            rows[strategy] = [[obj.pk for obj in getattr(instance, accessor).all()] for instance in instances]
+            # querysets built on top of the manager keep working
+            rows[strategy, 'filter'] = [list(getattr(instance, accessor).filter(pk__gt=1).values_list('pk', flat=True))
+                                        for instance in instances]
+        return rows
+
+    def assertSameRows(self, field, instances, accessor):
+        rows = self.rows(field, instances, accessor)
+        self.assertTrue(any(rows['distinct']))
+        for strategy in QUERY_STRATEGIES:
+            self.assertEqual(rows[strategy], rows['distinct'], strategy)
+            self.assertEqual(rows[strategy, 'filter'], rows['distinct', 'filter'], strategy)
+
+    def test_generic_source(self):
+        self.assertSameRows(Article._meta.get_field('tags'), self.articles, 'tags')
+
+    def test_generic_source_reverse(self):
+        self.assertSameRows(Article._meta.get_field('tags'), self.tags, 'article_set')
+
+    def test_foreign_key_source(self):
+        self.assertSameRows(Folder._meta.get_field('items'), self.folders, 'items')
+
+    def test_foreign_key_source_reverse(self):
+        self.assertSameRows(Folder._meta.get_field('items'), self.notes, 'folder_set')
+
+    def test_sql(self):
+        field = Article._meta.get_field('tags')
+        sql = {}
+        for strategy in QUERY_STRATEGIES:
+            field.query_strategy = strategy
+            sql[strategy] = str(self.articles[0].tags.all().query).upper()
+        self.assertIn('DISTINCT', sql['distinct'])
+        self.assertNotIn('DISTINCT', sql['join'])
+        self.assertIn('JOIN', sql['join'])
+        self.assertIn('EXISTS', sql['exists'])
+        self.assertNotIn('DISTINCT', sql['exists'])
@@ -0,0 +1,39 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.forms.util import ValidationError
+from django.test import TestCase
+
+from fields.TemplateField import TemplateFormField, invalidate_template_index, template_exists
+
+from testapp.models import Page
+
+class TemplateFieldTest(TestCase):
+    # the test settings use the cached loader around the filesystem loader
+
+    def setUp(self):
+        invalidate_template_index()
+
+    def test_template_exists(self):
+        self.assertTrue(template_exists('testapp/page.html'))
+        self.assertFalse(template_exists('testapp/missing.html'))
+
+    def test_clean(self):
+        field = TemplateFormField(max_length=255)
+        self.assertEqual(field.clean('testapp/page.html'), 'testapp/page.html')
+        self.assertEqual(field.clean('testapp/broken.html'), 'testapp/broken.html')
+        self.assertRaises(ValidationError, field.clean, 'testapp/missing.html')
+
+    def test_clean_strict(self):
+        field = TemplateFormField(max_length=255, strict=True)
+        self.assertEqual(field.clean('testapp/page.html'), 'testapp/page.html')
+        self.assertRaises(ValidationError, field.clean, 'testapp/broken.html')
+        self.assertRaises(ValidationError, field.clean, 'testapp/missing.html')
+
+    def test_check_templates(self):
+        Page.objects.create(template='testapp/page.html')
+        call_command('check_templates', stdout=StringIO())
+        Page.objects.create(template='testapp/missing.html')
+        stdout, stderr = StringIO(), StringIO()
+        self.assertRaises(SystemExit, call_command, 'check_templates', stdout=stdout, stderr=stderr)
+        self.assertIn('testapp/missing.html', stdout.getvalue())